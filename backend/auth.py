@@ -1,20 +1,20 @@
 import os
 from fastapi import Depends, HTTPException
 from fastapi import Cookie
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from models import User, RefreshToken
+from models import User
+from services.token_store import refresh_token_store
+from services.user_cache import UserPrincipal, get_user_principal
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-import secrets
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 MFA_SECRET_KEY = os.getenv("MFA_SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 MFA_TOKEN_EXPIRE_MINUTES = int(os.getenv("MFA_TOKEN_EXPIRE_MINUTES", 5))
-REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
@@ -32,22 +32,9 @@ def create_mfa_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, MFA_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def create_refresh_token(user: User, db: Session):
+async def create_refresh_token(user: User, db: AsyncSession):
 
-    token_str = secrets.token_urlsafe(32)
-    expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-
-    refresh_token = RefreshToken(
-        user_id = user.id,
-        token=token_str,
-        expires_at=expires_at
-    )
-
-    db.add(refresh_token)
-    db.commit()
-    db.refresh(refresh_token)
-
-    return token_str
+    return await refresh_token_store.issue(db, user.id)
 
 def verify_access_token(token: str):
 
@@ -79,13 +66,7 @@ def verify_mfa_token(token: str):
         return None
 
 
-def delete_expired_refresh_tokens(db: Session):
-
-    db.query(RefreshToken).filter(RefreshToken.expires_at < datetime.utcnow()).delete()
-    db.commit()
-
-
-def get_current_user_optional(access_token: Optional[str] = Cookie(None), db: Session = Depends(get_db)) -> Optional[User]:
+async def get_current_user_optional(access_token: Optional[str] = Cookie(None), db: AsyncSession = Depends(get_db)) -> Optional[UserPrincipal]:
     
     if not access_token:
         return None
@@ -98,14 +79,14 @@ def get_current_user_optional(access_token: Optional[str] = Cookie(None), db: Se
     if not user_id:
         return None
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await get_user_principal(db, user_id)
 
     if not user or not user.is_verified:
         return None
 
     return user
 
-def get_current_user(access_token: Optional[str] = Cookie(None), db: Session = Depends(get_db)):
+async def get_current_user(access_token: Optional[str] = Cookie(None), db: AsyncSession = Depends(get_db)) -> UserPrincipal:
     
     if not access_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -117,7 +98,7 @@ def get_current_user(access_token: Optional[str] = Cookie(None), db: Session = D
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await get_user_principal(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -0,0 +1,407 @@
+# Load and latency benchmark for the recipe and auth APIs.
+# Seeds a scratch database with synthetic users and recipes, then drives the application with
+# concurrent clients, either in-process (ASGI transport) or over HTTP (Uvicorn on a local port),
+# and reports RPS and p50/p95/p99 latency per endpoint.
+# Redis is replaced by fakeredis and email goes to a local SMTP sink, no external services are needed
+# (requires the fakeredis, aiosmtpd and httpx packages, plus uvicorn for --mode http).
+#
+# Run from the backend directory:
+#   python bench/load.py --recipes 10000 --concurrency 20 --requests 500
+#   python bench/load.py --endpoints list search get --save main       store bench/baselines/main.json
+#   python bench/load.py --compare main                                exit 1 if p95 regressed
+import argparse
+import asyncio
+import http.cookiejar
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(BACKEND_DIR, "bench", "baselines")
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_ENDPOINTS = ["list", "search", "text", "get", "login", "refresh", "create"]
+ENDPOINTS = DEFAULT_ENDPOINTS + ["register"]
+
+BENCH_PASSWORD = "bench-password"
+BATCH_SIZE = 10000
+
+DISH_TYPES = ["Main course", "Starter", "Dessert", "Soup", "Salad", "Breakfast", "Snack", "Side dish"]
+INGREDIENTS = [
+    "200 g flour", "2 eggs", "1 cup milk", "1 tsp salt", "3 tomatoes", "1 onion", "2 cloves garlic",
+    "500 g chicken", "1 cup rice", "basil", "1 lemon", "4 potatoes", "100 g cheese", "2 tbsp olive oil",
+    "1 carrot", "250 g pasta", "1 tbsp butter", "pepper", "300 ml cream", "1 cucumber",
+]
+
+# ---------------------------------------------------------------------------------------------------
+# Environment: scratch database, fakeredis and SMTP sink, set up before the application is imported
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class SmtpSink:
+
+    def __init__(self):
+        from aiosmtpd.controller import Controller
+
+        self.received = 0
+        self.port = free_port()
+        self.controller = Controller(self, hostname="127.0.0.1", port=self.port)
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 Message accepted"
+
+    def start(self):
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
+
+def configure_environment(args, smtp_port: int):
+    workdir = tempfile.mkdtemp(prefix="recipe-bench-")
+    os.chdir(workdir)
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/bench.db"
+    defaults = {
+        "SECRET_KEY": "bench-secret", "MFA_SECRET_KEY": "bench-mfa-secret",
+        "EMAIL_USERNAME": "bench", "EMAIL_PASSWORD": "bench", "EMAIL_FROM": "bench@example.com",
+        "FRONTEND_URL": "http://localhost:5174",
+        # Limits are not what is being measured
+        "RATE_LIMIT_POLICIES": "[]", "USERNAME_LIMIT": "1000000000", "IP_LIMIT": "1000000000",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+    os.environ.update(
+        MAIL_BACKEND="smtp", MAIL_SERVER="127.0.0.1", MAIL_PORT=str(smtp_port),
+        MAIL_STARTTLS="false", MAIL_SSL_TLS="false", MAIL_USE_CREDENTIALS="false",
+    )
+
+def use_fakeredis():
+    import fakeredis
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    redis.Redis = lambda *args, **kwargs: fakeredis.FakeRedis(server=server, decode_responses=kwargs.get("decode_responses", False))
+    redis.asyncio.Redis = lambda *args, **kwargs: fakeredis.FakeAsyncRedis(server=server, decode_responses=kwargs.get("decode_responses", False))
+
+# ---------------------------------------------------------------------------------------------------
+# Synthetic data: users with batched executemany on the sync engine, recipes through the bulk import's
+# batch insert so they get the same ingredient, token and full-text rows as imported ones
+
+def seed(recipes: int, users: int):
+    from database import engine
+    from migrations import upgrade
+
+    upgrade(engine)
+
+    started = time.perf_counter()
+    seed_users(users)
+    asyncio.run(seed_recipes(recipes, users))
+
+    print(f"Seeded {users} users and {recipes} recipes in {time.perf_counter() - started:.1f}s")
+
+def seed_users(users: int):
+    from sqlalchemy import insert
+    from database import engine
+    from models import User, UserRole
+    from services.password_service import pwd_context
+
+    password_hash = pwd_context.hash(BENCH_PASSWORD)
+
+    with engine.begin() as conn:
+        for first in range(1, users + 1, BATCH_SIZE):
+            conn.execute(insert(User), [
+                {"id": user_id, "username": f"bench{user_id}", "email": f"bench{user_id}@example.com",
+                 "password_hash": password_hash, "role": UserRole.USER, "is_verified": True, "mfa_enabled": False}
+                for user_id in range(first, min(first + BATCH_SIZE, users + 1))
+            ])
+
+# Recipes get ids 1..recipes in order (the database is empty), each chunk belongs to a random user
+async def seed_recipes(recipes: int, users: int):
+    from database import AsyncSessionLocal, async_engine
+    from schemas import Recipe as RecipeSchema
+    from services.bulk_import import BulkImport, BULK_IMPORT_CHUNK_SIZE
+
+    rng = random.Random(0)
+
+    async with AsyncSessionLocal() as db:
+        for first in range(1, recipes + 1, BULK_IMPORT_CHUNK_SIZE):
+            records = []
+            for number in range(first, min(first + BULK_IMPORT_CHUNK_SIZE, recipes + 1)):
+                recipe = RecipeSchema(
+                    recipe_name=f"Bench recipe {number}", recipe_ingredients=rng.sample(INGREDIENTS, rng.randint(3, 8)),
+                    preperation_time=rng.randint(5, 180), dish_type=rng.choice(DISH_TYPES), calories=rng.randint(50, 1500),
+                )
+                records.append((number, recipe, None))
+
+            await BulkImport(db, rng.randint(1, users)).insert(records)
+
+    # The benchmark runs in another event loop, its connections can't come from this one
+    await async_engine.dispose()
+
+# ---------------------------------------------------------------------------------------------------
+# Load generation
+
+# Cookies are sent explicitly per virtual user, the client itself keeps none
+class NoCookies(http.cookiejar.DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+def png_bytes() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (256, 256), (200, 80, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+class VirtualUser:
+
+    def __init__(self, number: int, users: int):
+        self.username = f"bench{number % users + 1}"
+        self.cookies = {}
+
+    def headers(self) -> dict:
+        return {"Cookie": "; ".join(f"{name}={value}" for name, value in self.cookies.items())} if self.cookies else {}
+
+    def remember(self, response):
+        self.cookies.update({name: value for name, value in response.cookies.items()})
+
+    async def login(self, client):
+        response = await client.post("/users/login", json={"username": self.username, "password": BENCH_PASSWORD})
+        self.remember(response)
+        return response
+
+class Workload:
+
+    def __init__(self, recipes: int, image: bytes):
+        self.recipes = recipes
+        self.image = image
+        self.created = 0
+        self.rng = random.Random(1)
+
+    async def request(self, endpoint: str, client, user: VirtualUser):
+        rng = self.rng
+
+        if endpoint == "list":
+            return await client.get("/recipes/", params={"limit": 10, "offset": rng.randrange(0, 90)})
+
+        if endpoint == "search":
+            params = rng.choice([
+                {"dish_type": rng.choice(DISH_TYPES).split()[0]},
+                {"calories": rng.randint(100, 1500)},
+                {"preperation_time": rng.randint(10, 180), "dish_type": rng.choice(DISH_TYPES)},
+                {"recipe_ingredients": json.dumps([rng.choice(["tomato", "egg", "rice", "chick"])])},
+            ])
+            return await client.post("/recipes/search", params=params)
+
+        # Free-text search: whole words, prefixes and misspellings
+        if endpoint == "text":
+            q = rng.choice(["tomatoes", "chick", "garlic soup", "potatos", "salad cucumber", "bench recipe"])
+            return await client.post("/recipes/search", params={"q": q})
+
+        if endpoint == "get":
+            return await client.get(f"/recipes/{rng.randint(1, self.recipes)}")
+
+        if endpoint == "login":
+            return await user.login(client)
+
+        if endpoint == "refresh":
+            response = await client.post("/users/refresh", headers=user.headers())
+            user.remember(response)
+            return response
+
+        if endpoint == "create":
+            self.created += 1
+            data = {
+                "recipe_name": f"Created {os.getpid()} {self.created} {rng.random()}",
+                "recipe_ingredients": json.dumps(rng.sample(INGREDIENTS, 4)),
+                "preperation_time": rng.randint(5, 180), "dish_type": rng.choice(DISH_TYPES),
+                "calories": rng.randint(50, 1500),
+            }
+            files = {"image": ("bench.png", self.image, "image/png")}
+            return await client.post("/recipes/", data=data, files=files, headers=user.headers())
+
+        if endpoint == "register":
+            self.created += 1
+            name = f"registered{os.getpid()}x{self.created}"
+            return await client.post("/users/register", data={"username": name, "email": f"{name}@example.com", "password": BENCH_PASSWORD})
+
+        raise ValueError(f"Unknown endpoint {endpoint}")
+
+async def run_endpoint(endpoint: str, client, workload: Workload, users: list[VirtualUser], requests: int) -> dict:
+
+    latencies = []
+    errors = {}
+    remaining = requests
+
+    async def worker(user: VirtualUser):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await workload.request(endpoint, client, user)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if not status.isdigit() or int(status) >= 400:
+                errors[status] = errors.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in users))
+    elapsed = time.perf_counter() - started
+
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_statuses": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+    }
+
+async def run_benchmark(args, base_url: str, transport=None) -> dict:
+    import httpx
+
+    workload = Workload(args.recipes, png_bytes())
+    users = [VirtualUser(number, args.users) for number in range(args.concurrency)]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits, timeout=60,
+                                 cookies=http.cookiejar.CookieJar(policy=NoCookies())) as client:
+        # Every virtual user starts logged in, so authenticated endpoints don't pay for the login
+        await asyncio.gather(*(user.login(client) for user in users))
+
+        for endpoint in args.endpoints:
+            await run_endpoint(endpoint, client, workload, users, min(args.warmup, args.requests))
+            results[endpoint] = await run_endpoint(endpoint, client, workload, users, args.requests)
+            print(format_row(endpoint, results[endpoint]), flush=True)
+
+    return results
+
+async def run_in_process(args) -> dict:
+    import httpx
+    import main
+
+    from services.mail_queue import get_mail_queue_stats
+
+    async with main.lifespan(main.app):
+        results = await run_benchmark(args, "https://bench", httpx.ASGITransport(app=main.app))
+
+        # Let the mail worker deliver what the run queued before shutting down
+        for _ in range(100):
+            stats = await get_mail_queue_stats()
+            if not stats["queued"] and not stats["sending"] and not stats["retrying"]:
+                break
+            await asyncio.sleep(0.1)
+
+        return results
+
+def run_over_http(args) -> dict:
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config("main:app", host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        return asyncio.run(run_benchmark(args, f"http://127.0.0.1:{port}"))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+# ---------------------------------------------------------------------------------------------------
+# Reporting and baselines
+
+HEADER = f"{'endpoint':<10} {'requests':>8} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+
+def format_row(endpoint: str, result: dict) -> str:
+    row = (f"{endpoint:<10} {result['requests']:>8} {result['errors']:>7} {result['rps']:>9} "
+           f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9}")
+    if result["error_statuses"]:
+        row += f"   {result['error_statuses']}"
+    return row
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    print(f"\nCompared with baseline {baseline['meta']}:")
+    regressed = False
+
+    for endpoint, result in results.items():
+        before = baseline["results"].get(endpoint)
+        if not before:
+            continue
+
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        rps_change = (result["rps"] - before["rps"]) / before["rps"] if before["rps"] else 0.0
+        slower = p95_change > tolerance
+        regressed |= slower
+        print(f"{endpoint:<10} p95 {before['p95_ms']:>9} -> {result['p95_ms']:>9} ms ({p95_change:+.0%})   "
+              f"rps {before['rps']:>9} -> {result['rps']:>9} ({rps_change:+.0%}){'   REGRESSION' if slower else ''}")
+
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipe and auth API load benchmark")
+    parser.add_argument("--recipes", type=int, default=10000, help="Number of synthetic recipes (10k to 10M)")
+    parser.add_argument("--users", type=int, default=1000, help="Number of synthetic users")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests per endpoint before measuring")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--database-url", help="Benchmark against this (empty) database instead of a scratch SQLite file")
+    parser.add_argument("--save", metavar="NAME", help="Store the results as bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with bench/baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    sink = SmtpSink()
+    sink.start()
+    configure_environment(args, sink.port)
+    use_fakeredis()
+    seed(args.recipes, args.users)
+
+    print(f"\n{args.mode}, {args.concurrency} clients, {args.requests} requests per endpoint\n{HEADER}")
+    try:
+        results = asyncio.run(run_in_process(args)) if args.mode == "inprocess" else run_over_http(args)
+    finally:
+        sink.stop()
+
+    if sink.received:
+        print(f"\nSMTP sink received {sink.received} messages")
+
+    meta = {"mode": args.mode, "recipes": args.recipes, "users": args.users,
+            "concurrency": args.concurrency, "requests": args.requests}
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save}.json"), "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Recipe list serialization benchmark: time from query to response bytes for pages of 10, 100 and 1000 recipes.
+# Compares the ORM path (Recipe objects, RecipeResponse validation, FastAPI's response model encoding)
+# with the column path used by the routers (plain rows, one ingredient query, orjson), both on a cache miss
+# and on a cache hit (the ORM path parsed and re-validated cached JSON, the column path sends it as is).
+# Run from the backend directory: python bench/serialization.py [--recipes 5000] [--rounds 20]
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGE_SIZES = [10, 100, 1000]
+
+async def timed(func, rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+async def run(rounds: int):
+    from typing import List
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    from database import AsyncSessionLocal
+    from models import Recipe
+    from routers.recipes import paginate
+    from schemas import RecipeResponse
+    from services.pagination import encode_cursor
+    from services.recipe_serializer import RECIPE_COLUMNS, serialize_recipes
+
+    # What FastAPI does with a List[RecipeResponse] response_model: validate the returned value, then encode it
+    response_adapter = TypeAdapter(List[RecipeResponse])
+    first_page = encode_cursor(0)
+
+    print(f"{'items':>6}  {'orm miss':>10}  {'column miss':>12}  {'speedup':>8}  {'orm hit':>10}  {'column hit':>11}  {'bytes':>8}")
+
+    for size in PAGE_SIZES:
+        async with AsyncSessionLocal() as db:
+
+            async def orm_miss():
+                recipes = (await db.scalars(select(Recipe).order_by(Recipe.id).limit(size + 1))).all()[:size]
+                items = [RecipeResponse.model_validate(recipe).model_dump() for recipe in recipes]
+                cached = json.dumps({"items": items, "next_cursor": None})
+                db.expunge_all()
+                return cached, response_adapter.dump_json(response_adapter.validate_python(items))
+
+            async def column_miss():
+                recipes, _ = await paginate(db, select(*RECIPE_COLUMNS), size, 0, first_page)
+                return await serialize_recipes(db, recipes)
+
+            cached, orm_body = await orm_miss()
+            column_body = await column_miss()
+            if json.loads(orm_body) != json.loads(column_body):
+                sys.exit(f"The two paths return different JSON for a page of {size}")
+
+            async def orm_hit():
+                return response_adapter.dump_json(response_adapter.validate_python(json.loads(cached)["items"]))
+
+            # Redis returns the cached body as a str, encoding it is all the response has left to do
+            async def column_hit():
+                return column_body.decode().encode()
+
+            orm_miss_ms = await timed(orm_miss, rounds)
+            column_miss_ms = await timed(column_miss, rounds)
+            orm_hit_ms = await timed(orm_hit, rounds)
+            column_hit_ms = await timed(column_hit, rounds)
+
+        print(f"{size:>6}  {orm_miss_ms:>8.2f}ms  {column_miss_ms:>10.2f}ms  {orm_miss_ms / column_miss_ms:>7.1f}x"
+              f"  {orm_hit_ms:>8.2f}ms  {column_hit_ms:>9.3f}ms  {len(column_body):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recipe list serialization paths")
+    parser.add_argument("--recipes", type=int, default=5000, help="Number of synthetic recipes to seed")
+    parser.add_argument("--rounds", type=int, default=20, help="Timed runs per page size, the median is reported")
+    args = parser.parse_args()
+
+    if args.recipes < max(PAGE_SIZES):
+        parser.error(f"--recipes must be at least {max(PAGE_SIZES)}")
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/serialization.db"
+
+    # Same synthetic catalogue as the load benchmark
+    from load import seed
+
+    seed(args.recipes, users=10)
+    asyncio.run(run(args.rounds))
+
+
+if __name__ == "__main__":
+    main()
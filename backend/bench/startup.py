@@ -0,0 +1,68 @@
+# Cold start benchmark: time to import the application and to finish the lifespan startup,
+# measured in fresh interpreters like a new Uvicorn worker would be.
+# Run from the backend directory against a migrated database:
+#   python bench/startup.py [--runs 10] [--top 15]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in the child process, prints "<import seconds> <startup seconds>"
+CHILD = """
+import asyncio, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def startup():
+    async with main.lifespan(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(startup())
+print(imported - start, ready - imported)
+"""
+
+def run_once() -> tuple[float, float]:
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=BACKEND_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    import_seconds, startup_seconds = output.split()[-2:]
+    return float(import_seconds), float(startup_seconds)
+
+# Modules with the largest cumulative import time, from python -X importtime
+def slowest_imports(top: int) -> list[tuple[int, str]]:
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                            check=True, capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # main itself is indented by one space, the modules it imports directly by three
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(cumulative), name.strip()))
+
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure application cold start time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest top level imports to list")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+
+    for label, values in (("import", [r[0] for r in runs]), ("lifespan startup", [r[1] for r in runs]),
+                          ("total", [r[0] + r[1] for r in runs])):
+        print(f"{label:<17} median {statistics.median(values) * 1000:8.1f} ms   "
+              f"min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+
+    print(f"\nSlowest imports of main (cumulative):")
+    for microseconds, name in slowest_imports(args.top):
+        print(f"{microseconds / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
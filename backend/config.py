@@ -1,5 +1,6 @@
+import json
 import os
-from fastapi_mail import ConnectionConfig
+from functools import cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,13 +10,42 @@ MAIL_PASS = os.getenv("EMAIL_PASSWORD")
 MAIL_FRM = os.getenv("EMAIL_FROM")
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
-mail_conf = ConnectionConfig(
-    MAIL_USERNAME=MAIL_USER,
-    MAIL_PASSWORD=MAIL_PASS,
-    MAIL_FROM=MAIL_FRM,
-    MAIL_PORT=587,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True
-)
\ No newline at end of file
+# "smtp" sends through the server below, "console" only logs the messages (local debugging)
+MAIL_BACKEND = os.getenv("MAIL_BACKEND", "smtp")
+
+# SMTP server, override to point at a local debugging server (e.g. MAIL_SERVER=localhost MAIL_PORT=1025
+# MAIL_STARTTLS=false MAIL_USE_CREDENTIALS=false with `python -m aiosmtpd -n -l localhost:1025`).
+# Built on first use by the mail worker, fastapi_mail is slow to import and not needed to serve requests.
+@cache
+def get_mail_conf():
+    from fastapi_mail import ConnectionConfig
+
+    return ConnectionConfig(
+        MAIL_USERNAME=MAIL_USER,
+        MAIL_PASSWORD=MAIL_PASS,
+        MAIL_FROM=MAIL_FRM,
+        MAIL_PORT=int(os.getenv("MAIL_PORT", 587)),
+        MAIL_SERVER=os.getenv("MAIL_SERVER", "smtp.gmail.com"),
+        MAIL_STARTTLS=os.getenv("MAIL_STARTTLS", "true").lower() == "true",
+        MAIL_SSL_TLS=os.getenv("MAIL_SSL_TLS", "false").lower() == "true",
+        USE_CREDENTIALS=os.getenv("MAIL_USE_CREDENTIALS", "true").lower() == "true"
+    )
+
+# Rate limit policies applied by RateLimitMiddleware to every matching request.
+# method/path (regex) select the requests, "per" keys the counter by client IP and/or logged in user,
+# and each policy allows `limit` requests per `window` seconds. Set RATE_LIMIT_POLICIES to a JSON list to override
+# ("[]" disables them, e.g. for load tests).
+DEFAULT_RATE_LIMIT_POLICIES = [
+    {"name": "api", "method": "*", "path": r"^/(recipes|users)(/|$)", "per": ["ip"], "limit": 300, "window": 60},
+    {"name": "search", "method": "POST", "path": r"^/recipes/search$", "per": ["ip", "user"], "limit": 60, "window": 60},
+    {"name": "upload", "method": "POST", "path": r"^/recipes/?$", "per": ["ip", "user"], "limit": 20, "window": 600},
+    {"name": "upload", "method": "PUT", "path": r"^/recipes/\d+$", "per": ["ip", "user"], "limit": 20, "window": 600},
+    {"name": "bulk", "method": "POST", "path": r"^/recipes/bulk$", "per": ["ip", "user"], "limit": 10, "window": 3600},
+    {"name": "export", "method": "GET", "path": r"^/recipes/export$", "per": ["ip", "user"], "limit": 10, "window": 3600},
+    {"name": "register", "method": "POST", "path": r"^/users/register$", "per": ["ip"], "limit": 5, "window": 3600},
+    {"name": "email", "method": "POST", "path": r"^/users/(forgot-password|resend-verification)$", "per": ["ip"], "limit": 5, "window": 3600},
+]
+
+RATE_LIMIT_POLICIES = json.loads(os.getenv("RATE_LIMIT_POLICIES", "null"))
+if RATE_LIMIT_POLICIES is None:
+    RATE_LIMIT_POLICIES = DEFAULT_RATE_LIMIT_POLICIES
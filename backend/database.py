@@ -1,24 +1,187 @@
 import os
-from sqlalchemy import create_engine
+import time
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
+from services.metrics import record_sql
 
 load_dotenv()
 
-# SQLAlchemy engine and session setup for SQLite
-engine = create_engine(os.getenv("DATABASE_URL"), connect_args={'check_same_thread': False})
+DATABASE_URL = make_url(os.getenv("DATABASE_URL"))
+
+# Async drivers used by the request path for each supported backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# Connection pool settings, sized per process (each Uvicorn worker gets its own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+# SQLite tuning: WAL lets readers run next to a writer, NORMAL sync is safe under WAL,
+# the busy timeout makes concurrent writers from several workers wait instead of failing
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5))
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64000)),  # negative = KiB, so 64MB
+}
+
+# Pool metrics, keyed by engine name
+pool_stats = {}
+
+# Start of the engine.connect() call currently waiting for a connection, read back by the pool's checkout event
+connect_started = ContextVar("connect_started", default=None)
+
+def record_pool_wait(stats: dict, seconds: float):
+    stats["waits"] += 1
+    stats["wait_seconds_total"] += seconds
+    stats["wait_seconds_max"] = max(stats["wait_seconds_max"], seconds)
+
+def is_memory_sqlite(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+# Keyword arguments for create_engine / create_async_engine depending on the backend
+def engine_options(url: URL, is_async: bool) -> dict:
+
+    options = {}
+
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT}
+
+    # In-memory SQLite must keep its single connection, everything else gets a sized queue pool
+    if not is_memory_sqlite(url):
+        options.update(
+            poolclass=AsyncAdaptedQueuePool if is_async else QueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=url.get_backend_name() != "sqlite",
+        )
+
+    return options
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+# Attach pragma setup, checkout counters and statement timing to a newly created engine
+def instrument_engine(name: str, sync_engine, url: URL):
+
+    if url.get_backend_name() == "sqlite" and not is_memory_sqlite(url):
+        event.listen(sync_engine, "connect", set_sqlite_pragmas)
+
+    stats = {"checkouts": 0, "connects": 0, "checked_out_peak": 0, "waits": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+    sync_engine.pool.stats = stats
+    pool_stats[name] = sync_engine.pool
+
+    # Sessions, engine.begin() and the async engine all get their connections through engine.connect(),
+    # so its start time is what the checkout event measures the wait from
+    connect = sync_engine.connect
+
+    def timed_connect():
+        token = connect_started.set(time.perf_counter())
+        try:
+            return connect()
+        finally:
+            connect_started.reset(token)
+
+    sync_engine.connect = timed_connect
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats["connects"] += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats["checkouts"] += 1
+        checked_out = sync_engine.pool.checkedout() if hasattr(sync_engine.pool, "checkedout") else 0
+        stats["checked_out_peak"] = max(stats["checked_out_peak"], checked_out)
+        started = connect_started.get()
+        if started is not None:
+            record_pool_wait(stats, time.perf_counter() - started)
+
+    # The start time is kept on the statement's execution context, a failed statement just drops it with the context
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        if context is not None and hasattr(context, "query_start"):
+            record_sql(name, statement, time.perf_counter() - context.query_start)
+
+# Engine factory: the same URL gives a sync engine or an async engine on the matching async driver
+def make_engine(url: URL, is_async: bool = False):
+
+    if is_async:
+        url = url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+        new_engine = create_async_engine(url, **engine_options(url, is_async=True))
+        instrument_engine("async", new_engine.sync_engine, url)
+    else:
+        new_engine = create_engine(url, **engine_options(url, is_async=False))
+        instrument_engine("sync", new_engine, url)
+
+    return new_engine
+
+# Current pool usage and counters of every engine
+def get_pool_stats() -> dict:
+
+    result = {}
+    for name, pool in pool_stats.items():
+        result[name] = {
+            **pool.stats,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        }
+
+    return result
+
+# Synchronous engine and session, used for table creation, seeding and scripts
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session, used by the routers so queries don't block the event loop
+async_engine = make_engine(DATABASE_URL, is_async=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Base is the declarative base for models
 Base = declarative_base()
 
-# get_db() is used as a FastAPI dependency to provide a session per request
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+ROLLBACK_CALLBACKS = "rollback_callbacks"
+
+# Register cleanup for when the session's transaction is not committed (e.g. removing a file written for a new row).
+# Callbacks run before the rollback, while the transaction's locks are still held, and are dropped on commit.
+def on_rollback(db, callback):
+    db.info.setdefault(ROLLBACK_CALLBACKS, []).append(callback)
+
+async def run_rollback_callbacks(db):
+    for callback in db.info.pop(ROLLBACK_CALLBACKS, []):
+        await callback()
 
+@event.listens_for(Session, "after_commit")
+def _drop_rollback_callbacks(session):
+    session.info.pop(ROLLBACK_CALLBACKS, None)
 
+# get_db() is used as a FastAPI dependency to provide an async session per request
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        finally:
+            await run_rollback_callbacks(db)
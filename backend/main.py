@@ -1,20 +1,82 @@
 from fastapi import FastAPI
-from database import Base, engine
+from contextlib import asynccontextmanager
+from database import engine, async_engine
 from routers.recipes import router as recipes_router
 from routers.users import router as users_router
-from fastapi.staticfiles import StaticFiles
+from routers.metrics import router as metrics_router
 from fastapi.middleware.cors import CORSMiddleware
-from seed import seed_admin
+from middleware.body_limit import BodySizeLimitMiddleware
+from middleware.rate_limit import RateLimitMiddleware
+from middleware.metrics import MetricsMiddleware
+from config import RATE_LIMIT_POLICIES
+from migrations import check_schema_version
+from services.file_service import MAX_FILE_SIZE
+from services.bulk_import import BULK_IMPORT_MAX_BODY_SIZE
+from services.image_service import CachedStaticFiles
+from services.image_store import run_garbage_collector
+from services.mail_queue import run_mail_worker
+from services.token_store import run_refresh_token_sweeper
+from services.user_cache import run_user_cache_listener
+from services.email_service import get_templates
+from services.password_service import shutdown_password_pool
+from redis_client import init_redis, close_redis
 from pathlib import Path
+import asyncio
+import os
 
-# Create all tables in the database if they do not exist
-Base.metadata.create_all(bind=engine)
+# Directories served as static files, created at startup
+STATIC_DIRS = ["uploads/profiles", "images/blobs"]
 
-#Seed Admin
-seed_admin()
+# How long shutdown waits for cancelled background jobs to finish their cleanup
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 5))
+
+# Schema changes and seeding are one-shot commands (python manage.py migrate / seed),
+# workers only check that the database is at the expected revision.
+# Importing this module has no side effects, connections, directories, templates and
+# background jobs are set up here and torn down on shutdown.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_schema_version(engine)
+    for directory in STATIC_DIRS:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+    await init_redis()
+    get_templates()
+
+    background_jobs = [
+        asyncio.create_task(run_garbage_collector()),
+        asyncio.create_task(run_mail_worker()),
+        asyncio.create_task(run_refresh_token_sweeper()),
+        asyncio.create_task(run_user_cache_listener()),
+    ]
+    yield
+
+    # Jobs are stopped before the connections they use are closed,
+    # a job stuck in a blocking call must not hold up the shutdown forever
+    for job in background_jobs:
+        job.cancel()
+    await asyncio.wait(background_jobs, timeout=SHUTDOWN_TIMEOUT)
+
+    shutdown_password_pool()
+    await close_redis()
+    await async_engine.dispose()
+    engine.dispose()
 
 # Start-up for FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Reject oversized request bodies while they stream in (image size limit plus room for the form fields),
+# bulk imports carry a whole catalogue and get their own limit
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_size=int(os.getenv("MAX_REQUEST_BODY_SIZE", MAX_FILE_SIZE + 1024 * 1024)),
+    path_limits={"/recipes/bulk": BULK_IMPORT_MAX_BODY_SIZE},
+)
+
+# Per route, per IP and per user request limits declared in config.RATE_LIMIT_POLICIES
+app.add_middleware(RateLimitMiddleware, policies=RATE_LIMIT_POLICIES)
+
+# Wraps the body size and rate limiters, so their time and rejected requests are counted too
+app.add_middleware(MetricsMiddleware)
 
 #
 app.add_middleware(
@@ -23,13 +85,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Retry-After"],
 )
 
-# Include routers for recipes and users
+# Include routers for recipes, users and metrics
 app.include_router(recipes_router)
 app.include_router(users_router)
-Path("uploads/profiles").mkdir(parents=True, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.include_router(metrics_router)
+app.mount("/uploads", CachedStaticFiles(directory="uploads", check_dir=False), name="uploads")
+app.mount("/images/blobs", CachedStaticFiles(directory="images/blobs", immutable=True, check_dir=False), name="image_blobs")
+app.mount("/images", CachedStaticFiles(directory="images", check_dir=False), name="images")
 
 
 
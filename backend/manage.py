@@ -0,0 +1,54 @@
+# One-shot maintenance commands, run from the backend directory before starting the application:
+#   python manage.py migrate [--revision N]   apply pending schema migrations
+#   python manage.py seed                     create the admin user
+#   python manage.py status                   show the current and latest schema revision
+#   python manage.py derivatives              generate the missing derivatives of stored recipe and profile images
+import argparse
+import os
+from database import engine
+from migrations import upgrade, current_revision, head_revision
+
+# Images stored before derivatives existed (or whose background generation failed) only have the original file
+def generate_missing_derivatives() -> int:
+    from sqlalchemy import select, union
+    from models import Recipe, User
+    from services.image_service import generate_derivatives
+
+    with engine.connect() as conn:
+        urls = conn.scalars(union(
+            select(Recipe.image_url).where(Recipe.image_url.is_not(None)),
+            select(User.profile_image).where(User.profile_image.is_not(None)),
+        )).all()
+
+    paths = [url.lstrip("/") for url in urls if os.path.exists(url.lstrip("/"))]
+    for path in paths:
+        generate_derivatives(path)
+
+    return len(paths)
+
+def main():
+    parser = argparse.ArgumentParser(description="Personal Recipe Manager maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate", help="Apply pending schema migrations")
+    migrate.add_argument("--revision", type=int, default=None, help="Stop at this revision instead of the latest")
+    commands.add_parser("seed", help="Create the admin user from ADMIN_* environment variables")
+    commands.add_parser("status", help="Show the schema revision")
+    commands.add_parser("derivatives", help="Generate missing image derivatives (thumbnail, WebP, AVIF)")
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"Database is at revision {upgrade(engine, args.revision)}")
+    elif args.command == "seed":
+        from seed import seed_admin
+        seed_admin()
+    elif args.command == "status":
+        with engine.connect() as conn:
+            print(f"Database is at revision {current_revision(conn)}, latest is {head_revision()}")
+    elif args.command == "derivatives":
+        print(f"Checked the derivatives of {generate_missing_derivatives()} images")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+from fastapi import HTTPException
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from typing import Optional
+
+# Rejects request bodies larger than max_body_size while they are being received,
+# so oversized uploads are never spooled to disk or memory by the multipart parser.
+# path_limits sets a different limit for some paths (e.g. bulk imports).
+class BodySizeLimitMiddleware:
+
+    def __init__(self, app: ASGIApp, max_body_size: int, path_limits: Optional[dict[str, int]] = None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_body_size = self.path_limits.get(scope["path"], self.max_body_size)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+            response = PlainTextResponse("Request body too large", status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        # Bodies sent without (or with a wrong) Content-Length are counted chunk by chunk
+        async def limited_receive():
+            nonlocal received
+
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,52 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from services.metrics import RequestMetrics, current_request, record_request, SERVER_TIMING_ENABLED
+
+# Times every request and collects the SQL, Redis and bcrypt work done for it.
+# Latency is recorded per route template ("/recipes/{recipe_id}"), so ids don't create new series,
+# and the breakdown is sent back in a Server-Timing header (shown by the browser dev tools).
+# A request is recorded once its last body chunk is sent: background tasks run after that, inside the same call,
+# and neither their time nor their queries count towards the request.
+class MetricsMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        status = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            recorded = True
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            record_request(metrics, scope["method"], getattr(route, "path", None) or "unmatched", status)
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", metrics.server_timing().encode())]
+
+            await send(message)
+
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not recorded:
+                record()
+                current_request.set(None)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            # No complete response was sent (an exception, or the client went away)
+            if not recorded:
+                record()
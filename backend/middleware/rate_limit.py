@@ -0,0 +1,92 @@
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from redis.exceptions import RedisError
+from auth import verify_access_token
+from services.brute_force import limiter
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Applies the rate limit policies from config to every request, with counters shared by all workers
+# through the limiter backend. Responses carry X-RateLimit-* headers for the most restrictive policy.
+class RateLimitMiddleware:
+
+    def __init__(self, app: ASGIApp, policies: list[dict]):
+        self.app = app
+        self.policies = [{**policy, "pattern": re.compile(policy["path"])} for policy in policies]
+
+    # Logged in user id from the access token cookie, None for anonymous requests
+    def _user_id(self, connection: HTTPConnection):
+        token = connection.cookies.get("access_token")
+        if not token:
+            return None
+
+        if token.startswith("Bearer "):
+            token = token[len("Bearer "):]
+
+        return verify_access_token(token)
+
+    def _rules(self, scope: Scope) -> list[tuple[str, int, int]]:
+        connection = HTTPConnection(scope)
+        ip = connection.client.host if connection.client else "unknown"
+        user_id = None
+        rules = []
+
+        for policy in self.policies:
+            if policy["method"] not in ("*", scope["method"]) or not policy["pattern"].search(scope["path"]):
+                continue
+
+            for per in policy["per"]:
+                if per == "user":
+                    user_id = user_id or self._user_id(connection)
+                    if user_id is None:
+                        continue
+                    rules.append((f"ratelimit:{policy['name']}:user:{user_id}", policy["limit"], policy["window"]))
+                else:
+                    rules.append((f"ratelimit:{policy['name']}:ip:{ip}", policy["limit"], policy["window"]))
+
+        return rules
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rules = self._rules(scope)
+        if not rules:
+            await self.app(scope, receive, send)
+            return
+
+        # Fail open, an unavailable limiter store must not take the API down
+        try:
+            result = await limiter.hit(rules)
+        except RedisError:
+            logger.exception("Rate limiter unavailable")
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            "X-RateLimit-Limit": str(result.limit),
+            "X-RateLimit-Remaining": str(max(result.remaining, 0)),
+            "X-RateLimit-Reset": str(result.reset),
+        }
+
+        if not result.allowed:
+            headers["Retry-After"] = str(result.retry_after)
+            response = JSONResponse({"detail": "Too many requests"}, status_code=429, headers=headers)
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (name.lower().encode(), value.encode()) for name, value in headers.items()
+                ]
+
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
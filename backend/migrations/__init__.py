@@ -0,0 +1,85 @@
+# Versioned schema migrations.
+# Every module in migrations/versions defines `revision` (consecutive integers starting at 1) and `upgrade(conn)`.
+# Migrations run in their own transaction, unless they set `transactional = False` (e.g. to build
+# Postgres indexes CONCURRENTLY, which is not allowed inside a transaction).
+# Migrations don't import application code, the helpers they need are copied into them so a revision always
+# does what it did when it was written.
+# The applied revision is stored in the schema_version table, the application only checks it at startup.
+from sqlalchemy import Table, Column, Integer, MetaData, inspect, select, delete, insert
+from sqlalchemy.engine import Connection, Engine
+import importlib
+import pkgutil
+
+from migrations import versions
+
+schema_version = Table("schema_version", MetaData(), Column("version", Integer, nullable=False))
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+def load_migrations() -> list:
+
+    migrations = [
+        importlib.import_module(f"{versions.__name__}.{module.name}")
+        for module in pkgutil.iter_modules(versions.__path__)
+    ]
+    migrations.sort(key=lambda migration: migration.revision)
+
+    for expected, migration in enumerate(migrations, start=1):
+        if migration.revision != expected:
+            raise SchemaVersionError(f"Migration {migration.__name__} has revision {migration.revision}, expected {expected}")
+
+    return migrations
+
+def head_revision() -> int:
+    return len(load_migrations())
+
+def current_revision(conn: Connection) -> int:
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+
+    return conn.scalar(select(schema_version.c.version)) or 0
+
+def set_revision(conn: Connection, revision: int):
+    schema_version.create(conn, checkfirst=True)
+    conn.execute(delete(schema_version))
+    conn.execute(insert(schema_version).values(version=revision))
+
+# Apply all pending migrations up to `target` (the latest by default), returns the new revision
+def upgrade(engine: Engine, target: int = None) -> int:
+
+    migrations = load_migrations()
+    target = len(migrations) if target is None else target
+
+    with engine.connect() as conn:
+        revision = current_revision(conn)
+
+    for migration in migrations[revision:target]:
+        print(f"Applying {migration.revision}: {migration.__doc__.strip()}")
+
+        if getattr(migration, "transactional", True):
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+                set_revision(conn, migration.revision)
+        else:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                migration.upgrade(conn)
+            with engine.begin() as conn:
+                set_revision(conn, migration.revision)
+
+        revision = migration.revision
+
+    return revision
+
+# Startup check: refuse to serve requests against a database that is not at the latest revision
+def check_schema_version(engine: Engine):
+
+    with engine.connect() as conn:
+        revision = current_revision(conn)
+
+    head = head_revision()
+    if revision != head:
+        raise SchemaVersionError(
+            f"Database schema is at revision {revision}, this version of the application needs {head}. "
+            f"Run `python manage.py migrate` first."
+        )
@@ -0,0 +1,58 @@
+"""Initial schema: users, recipes and refresh_tokens"""
+from sqlalchemy import Table, Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Enum, MetaData
+from sqlalchemy.types import JSON
+from sqlalchemy.engine import Connection
+
+revision = 1
+
+# Snapshot of the tables as they were first created. Databases created before migrations
+# existed already have them and are adopted as they are.
+metadata = MetaData()
+
+Table(
+    "recipes", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("recipe_name", String, index=True, unique=True, nullable=False),
+    Column("recipe_ingredients", JSON, nullable=False),
+    Column("preperation_time", Integer, nullable=False),
+    Column("dish_type", String, nullable=False),
+    Column("calories", Integer, nullable=False),
+    Column("image_url", String, nullable=True),
+    Column("owner_id", Integer, ForeignKey("users.id")),
+)
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, index=True, unique=True, nullable=False),
+    Column("password_hash", String, nullable=False),
+    Column("email", String, index=True, unique=True, nullable=False),
+    Column("role", Enum("USER", "ADMIN", name="userrole"), nullable=False),
+    Column("full_name", String, nullable=True),
+    Column("phone", String, nullable=True),
+    Column("city", String, nullable=True),
+    Column("country", String, nullable=True),
+    Column("dob", Date, nullable=True),
+    Column("profile_image", String, nullable=True),
+    Column("is_verified", Boolean),
+    Column("verification_token", String, nullable=True),
+    Column("verification_token_expires_at", DateTime, nullable=True),
+    Column("reset_password_token", String, nullable=True),
+    Column("reset_password_token_expires_at", DateTime, nullable=True),
+    Column("mfa_enabled", Boolean),
+    Column("mfa_last_verified", DateTime, nullable=True),
+    Column("mfa_secret", String, nullable=True),
+    Column("favorite_recipe_id", Integer, ForeignKey("recipes.id", use_alter=True), nullable=True),
+)
+
+Table(
+    "refresh_tokens", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("token", String, unique=True, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+    Column("created_at", DateTime),
+)
+
+def upgrade(conn: Connection):
+    metadata.create_all(conn, checkfirst=True)
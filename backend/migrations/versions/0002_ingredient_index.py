@@ -0,0 +1,54 @@
+"""Inverted ingredient index"""
+from sqlalchemy import Table, Column, Integer, String, ForeignKey, MetaData, inspect, insert, select, text
+from sqlalchemy.engine import Connection
+import json
+import re
+
+revision = 2
+
+BATCH_SIZE = 1000
+
+# Frozen copy of services.ingredient_index.tokenize() as of this revision,
+# the migration must not change when the service does
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> set[str]:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+metadata = MetaData()
+Table("recipes", metadata, Column("id", Integer, primary_key=True))
+
+ingredient_index = Table(
+    "ingredient_index", metadata,
+    Column("token", String, primary_key=True),
+    Column("recipe_id", Integer, ForeignKey("recipes.id", ondelete="CASCADE"), primary_key=True, index=True),
+)
+
+def upgrade(conn: Connection):
+    ingredient_index.create(conn, checkfirst=True)
+
+    # Index the existing recipes from their ingredient list
+    recipe_columns = {column["name"] for column in inspect(conn).get_columns("recipes")}
+    if "recipe_ingredients" not in recipe_columns or conn.scalar(select(ingredient_index.c.recipe_id).limit(1)) is not None:
+        return
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("SELECT id, recipe_ingredients FROM recipes WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        values = []
+        for row in rows:
+            ingredients = json.loads(row.recipe_ingredients) if isinstance(row.recipe_ingredients, str) else row.recipe_ingredients
+            tokens = set()
+            for ingredient in ingredients or []:
+                tokens |= tokenize(str(ingredient))
+            values.extend({"token": token, "recipe_id": row.id} for token in tokens)
+
+        if values:
+            conn.execute(insert(ingredient_index), values)
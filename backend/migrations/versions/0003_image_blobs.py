@@ -0,0 +1,18 @@
+"""Reference counted image blob store"""
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData
+from sqlalchemy.engine import Connection
+
+revision = 3
+
+metadata = MetaData()
+
+image_blobs = Table(
+    "image_blobs", metadata,
+    Column("hash", String, primary_key=True),
+    Column("path", String, nullable=False),
+    Column("ref_count", Integer, nullable=False),
+    Column("released_at", DateTime, nullable=True, index=True),
+)
+
+def upgrade(conn: Connection):
+    image_blobs.create(conn, checkfirst=True)
@@ -0,0 +1,33 @@
+"""Index token lookups and refresh token expiry"""
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, Index
+from sqlalchemy.engine import Connection
+
+revision = 5
+
+# Indexes are built CONCURRENTLY on Postgres so the tables stay writable, which needs autocommit
+transactional = False
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("verification_token", String),
+    Column("reset_password_token", String),
+)
+
+refresh_tokens = Table(
+    "refresh_tokens", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("expires_at", DateTime),
+)
+
+indexes = [
+    Index("ix_refresh_tokens_expires_at", refresh_tokens.c.expires_at, postgresql_concurrently=True),
+    Index("ix_users_verification_token", users.c.verification_token, unique=True, postgresql_concurrently=True),
+    Index("ix_users_reset_password_token", users.c.reset_password_token, unique=True, postgresql_concurrently=True),
+]
+
+def upgrade(conn: Connection):
+    for index in indexes:
+        index.create(conn, checkfirst=True)
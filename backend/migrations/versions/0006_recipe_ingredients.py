@@ -0,0 +1,135 @@
+"""Move recipe ingredients from the JSON column into typed recipe_ingredients rows"""
+from sqlalchemy import Table, Column, Integer, String, Float, ForeignKey, MetaData, Index, inspect, insert, select, text
+from sqlalchemy.engine import Connection
+from fractions import Fraction
+import json
+import re
+
+revision = 6
+
+BATCH_SIZE = 1000
+
+# Frozen copy of services.ingredient_parser.parse_ingredient() as of this revision,
+# the migration must not change when the service does
+
+# Units recognised after a leading quantity, mapped to their canonical spelling
+UNITS = {
+    "g": "g", "gram": "g", "grams": "g", "gr": "g",
+    "kg": "kg", "kilogram": "kg", "kilograms": "kg",
+    "mg": "mg",
+    "ml": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml",
+    "l": "l", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "dl": "dl", "cl": "cl",
+    "tsp": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "tbsp": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "cup": "cup", "cups": "cup",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "pinch": "pinch", "pinches": "pinch",
+    "clove": "clove", "cloves": "clove",
+    "slice": "slice", "slices": "slice",
+    "can": "can", "cans": "can",
+    "piece": "piece", "pieces": "piece", "pcs": "piece",
+}
+
+UNICODE_FRACTIONS = {"½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4", "⅛": "1/8"}
+
+# Leading quantity: "2", "1.5", "1,5", "1/2" or "1 1/2", optionally followed by a unit
+QUANTITY_PATTERN = re.compile(r"^\s*(\d+\s+\d+/\d+|\d+/\d+|\d+(?:[.,]\d+)?)\s*([^\W\d]+\.?)?\s*(.*)$")
+KEY_PATTERN = re.compile(r"\w+")
+
+def parse_quantity(value: str) -> float:
+    whole, _, fraction = value.rpartition(" ")
+    if "/" in fraction:
+        return float(int(whole or 0) + Fraction(fraction))
+    return float(value.replace(",", "."))
+
+def lookup_key(name: str) -> str:
+    return " ".join(KEY_PATTERN.findall(name.lower()))
+
+def parse_ingredient(text: str) -> dict:
+
+    normalized = text
+    for symbol, fraction in UNICODE_FRACTIONS.items():
+        normalized = normalized.replace(symbol, f" {fraction}")
+
+    quantity = unit = None
+    name = text.strip()
+
+    match = QUANTITY_PATTERN.match(normalized)
+    if match:
+        amount, word, rest = match.groups()
+        quantity = parse_quantity(" ".join(amount.split()))
+
+        if word and word.rstrip(".").lower() in UNITS:
+            unit = UNITS[word.rstrip(".").lower()]
+            name = rest
+        else:
+            name = f"{word or ''} {rest}"
+
+        name = name.strip() or text.strip()
+
+    return {
+        "text": text,
+        "name": name,
+        "key": lookup_key(name),
+        "quantity": quantity,
+        "unit": unit,
+    }
+
+metadata = MetaData()
+Table("recipes", metadata, Column("id", Integer, primary_key=True))
+
+recipe_ingredients = Table(
+    "recipe_ingredients", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("recipe_id", Integer, ForeignKey("recipes.id", ondelete="CASCADE"), nullable=False, index=True),
+    Column("position", Integer, nullable=False),
+    Column("text", String, nullable=False),
+    Column("name", String, nullable=False),
+    Column("key", String, nullable=False),
+    Column("quantity", Float, nullable=True),
+    Column("unit", String, nullable=True),
+    Index("ix_recipe_ingredients_key_recipe_id", "key", "recipe_id"),
+)
+
+def upgrade(conn: Connection):
+    recipe_ingredients.create(conn, checkfirst=True)
+
+    if "recipe_ingredients" not in {column["name"] for column in inspect(conn).get_columns("recipes")}:
+        return
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("SELECT id, recipe_ingredients FROM recipes WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        done = set(conn.scalars(
+            select(recipe_ingredients.c.recipe_id).where(recipe_ingredients.c.recipe_id.in_([row.id for row in rows]))
+        ))
+
+        values = []
+        for row in rows:
+            if row.id in done:
+                continue
+
+            ingredients = row.recipe_ingredients
+            if isinstance(ingredients, str):
+                ingredients = json.loads(ingredients)
+            if isinstance(ingredients, str):
+                ingredients = [ingredients]
+
+            values.extend(
+                {"recipe_id": row.id, "position": position, **parse_ingredient(str(ingredient))}
+                for position, ingredient in enumerate(ingredients or [])
+            )
+
+        if values:
+            conn.execute(insert(recipe_ingredients), values)
+
+    conn.execute(text("ALTER TABLE recipes DROP COLUMN recipe_ingredients"))
@@ -0,0 +1,43 @@
+"""Normalized dish type key of recipes"""
+from sqlalchemy import Table, Column, Integer, String, MetaData, select, update, text, inspect, bindparam
+from sqlalchemy.engine import Connection
+import re
+
+revision = 7
+
+BATCH_SIZE = 1000
+
+# Frozen copy of services.ingredient_parser.lookup_key() as of this revision,
+# the migration must not change when the service does
+KEY_PATTERN = re.compile(r"\w+")
+
+def lookup_key(name: str) -> str:
+    return " ".join(KEY_PATTERN.findall(name.lower()))
+
+metadata = MetaData()
+
+recipes = Table(
+    "recipes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("dish_type", String),
+    Column("dish_type_key", String),
+)
+
+def upgrade(conn: Connection):
+
+    if "dish_type_key" not in {column["name"] for column in inspect(conn).get_columns("recipes")}:
+        conn.execute(text("ALTER TABLE recipes ADD COLUMN dish_type_key VARCHAR DEFAULT '' NOT NULL"))
+
+    # Computed in Python, SQL lower() only folds ASCII on SQLite. One UPDATE per batch (executemany).
+    statement = update(recipes).where(recipes.c.id == bindparam("row_id")).values(dish_type_key=bindparam("key"))
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(recipes.c.id, recipes.c.dish_type).where(recipes.c.id > last_id).order_by(recipes.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        conn.execute(statement, [{"row_id": row_id, "key": lookup_key(dish_type)} for row_id, dish_type in rows])
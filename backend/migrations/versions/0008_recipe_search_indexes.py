@@ -0,0 +1,28 @@
+"""Indexes on the recipe search filters"""
+from sqlalchemy import Table, Column, Integer, String, MetaData, Index
+from sqlalchemy.engine import Connection
+
+revision = 8
+
+# Indexes are built CONCURRENTLY on Postgres so the table stays writable, which needs autocommit
+transactional = False
+
+metadata = MetaData()
+
+recipes = Table(
+    "recipes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("dish_type_key", String),
+    Column("preperation_time", Integer),
+    Column("calories", Integer),
+)
+
+indexes = [
+    Index("ix_recipes_dish_type_key_preperation_time", recipes.c.dish_type_key, recipes.c.preperation_time, postgresql_concurrently=True),
+    Index("ix_recipes_preperation_time_calories", recipes.c.preperation_time, recipes.c.calories, postgresql_concurrently=True),
+    Index("ix_recipes_calories", recipes.c.calories, postgresql_concurrently=True),
+]
+
+def upgrade(conn: Connection):
+    for index in indexes:
+        index.create(conn, checkfirst=True)
@@ -0,0 +1,101 @@
+"""Full-text search index over recipe names, dish types and ingredients"""
+from sqlalchemy import Table, Column, Integer, String, MetaData, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+import re
+
+revision = 9
+
+BATCH_SIZE = 1000
+
+# Frozen copies of the services.recipe_search helpers as of this revision,
+# the migration must not change when the service does
+TERM_PATTERN = re.compile(r"[^\W_]+")
+
+def document(recipe_id: int, recipe_name: str, dish_type: str, ingredients: list[str]) -> dict:
+    return {"recipe_id": recipe_id, "recipe_name": recipe_name, "dish_type": dish_type, "ingredients": " ".join(ingredients)}
+
+def document_terms(values: dict) -> set[str]:
+    return set(TERM_PATTERN.findall(" ".join((values["recipe_name"], values["dish_type"], values["ingredients"])).lower()))
+
+def index_statement(dialect: str):
+    if dialect == "postgresql":
+        return text(
+            "INSERT INTO recipe_search (recipe_id, document) VALUES (:recipe_id, "
+            "setweight(to_tsvector('simple', :recipe_name), 'A') || "
+            "setweight(to_tsvector('simple', :dish_type), 'B') || "
+            "setweight(to_tsvector('simple', :ingredients), 'C')) "
+            "ON CONFLICT (recipe_id) DO UPDATE SET document = excluded.document"
+        )
+
+    return text(
+        "INSERT OR REPLACE INTO recipe_search (rowid, recipe_name, dish_type, ingredients) "
+        "VALUES (:recipe_id, :recipe_name, :dish_type, :ingredients)"
+    )
+
+metadata = MetaData()
+
+recipes = Table(
+    "recipes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("recipe_name", String),
+    Column("dish_type", String),
+)
+
+recipe_ingredients = Table(
+    "recipe_ingredients", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("recipe_id", Integer),
+    Column("position", Integer),
+    Column("text", String),
+)
+
+search_terms = Table("recipe_search_terms", metadata, Column("term", String, primary_key=True))
+
+def upgrade(conn: Connection):
+    dialect = conn.dialect.name
+
+    if dialect == "postgresql":
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS recipe_search ("
+            "recipe_id INTEGER PRIMARY KEY REFERENCES recipes (id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)"
+        ))
+    else:
+        # Same word splitting as Postgres' "simple" configuration, prefix indexes speed up short prefix queries
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS recipe_search USING fts5("
+            "recipe_name, dish_type, ingredients, tokenize = 'unicode61 remove_diacritics 0', prefix = '2 3')"
+        ))
+
+    search_terms.create(conn, checkfirst=True)
+
+    # Index the existing recipes
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(recipes.c.id, recipes.c.recipe_name, recipes.c.dish_type)
+            .where(recipes.c.id > last_id).order_by(recipes.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        ingredients = {row.id: [] for row in rows}
+        for recipe_id, ingredient in conn.execute(
+            select(recipe_ingredients.c.recipe_id, recipe_ingredients.c.text)
+            .where(recipe_ingredients.c.recipe_id.in_(list(ingredients)))
+            .order_by(recipe_ingredients.c.recipe_id, recipe_ingredients.c.position)
+        ):
+            ingredients[recipe_id].append(ingredient)
+
+        documents = [document(row.id, row.recipe_name, row.dish_type, ingredients[row.id]) for row in rows]
+        conn.execute(index_statement(dialect), documents)
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        terms = sorted(set().union(*(document_terms(values) for values in documents)))
+        conn.execute(insert(search_terms).on_conflict_do_nothing(), [{"term": term} for term in terms])
+
+    # Built after the backfill, a GIN index is much faster to create in one go than to update row by row
+    if dialect == "postgresql":
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recipe_search_document ON recipe_search USING GIN (document)"))
@@ -0,0 +1,76 @@
+"""Count the recipes using each search term"""
+from sqlalchemy import Table, Column, Integer, String, MetaData, select, delete, insert, text, inspect
+from sqlalchemy.engine import Connection
+from collections import Counter
+import re
+
+revision = 10
+
+BATCH_SIZE = 1000
+
+# Frozen copies of the services.recipe_search helpers as of this revision,
+# the migration must not change when the service does
+TERM_PATTERN = re.compile(r"[^\W_]+")
+
+def document(recipe_id: int, recipe_name: str, dish_type: str, ingredients: list[str]) -> dict:
+    return {"recipe_id": recipe_id, "recipe_name": recipe_name, "dish_type": dish_type, "ingredients": " ".join(ingredients)}
+
+def document_terms(values: dict) -> set[str]:
+    return set(TERM_PATTERN.findall(" ".join((values["recipe_name"], values["dish_type"], values["ingredients"])).lower()))
+
+metadata = MetaData()
+
+recipes = Table(
+    "recipes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("recipe_name", String),
+    Column("dish_type", String),
+)
+
+recipe_ingredients = Table(
+    "recipe_ingredients", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("recipe_id", Integer),
+    Column("position", Integer),
+    Column("text", String),
+)
+
+search_terms = Table(
+    "recipe_search_terms", metadata,
+    Column("term", String, primary_key=True),
+    Column("recipe_count", Integer),
+)
+
+def upgrade(conn: Connection):
+
+    if "recipe_count" not in {column["name"] for column in inspect(conn).get_columns("recipe_search_terms")}:
+        conn.execute(text("ALTER TABLE recipe_search_terms ADD COLUMN recipe_count INTEGER DEFAULT 0 NOT NULL"))
+
+    # The vocabulary is rebuilt from the recipes, which also drops the terms of deleted recipes
+    counts = Counter()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(recipes.c.id, recipes.c.recipe_name, recipes.c.dish_type)
+            .where(recipes.c.id > last_id).order_by(recipes.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        ingredients = {row.id: [] for row in rows}
+        for recipe_id, ingredient in conn.execute(
+            select(recipe_ingredients.c.recipe_id, recipe_ingredients.c.text)
+            .where(recipe_ingredients.c.recipe_id.in_(list(ingredients)))
+            .order_by(recipe_ingredients.c.recipe_id, recipe_ingredients.c.position)
+        ):
+            ingredients[recipe_id].append(ingredient)
+
+        for row in rows:
+            counts.update(document_terms(document(row.id, row.recipe_name, row.dish_type, ingredients[row.id])))
+
+    conn.execute(delete(search_terms))
+
+    terms = sorted(counts.items())
+    for start in range(0, len(terms), BATCH_SIZE):
+        conn.execute(insert(search_terms), [{"term": term, "recipe_count": count} for term, count in terms[start:start + BATCH_SIZE]])
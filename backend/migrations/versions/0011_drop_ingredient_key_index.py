@@ -0,0 +1,24 @@
+"""Drop the unused index on recipe ingredient keys"""
+from sqlalchemy import Table, Column, Integer, String, MetaData, Index
+from sqlalchemy.engine import Connection
+
+revision = 11
+
+# Ingredient searches go through the ingredient_index posting lists (any word of an ingredient, by prefix),
+# nothing looks recipes up by the whole ingredient key, so its index only slowed down every recipe write.
+# Dropped CONCURRENTLY on Postgres so the table stays writable, which needs autocommit.
+transactional = False
+
+metadata = MetaData()
+
+recipe_ingredients = Table(
+    "recipe_ingredients", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("recipe_id", Integer),
+    Column("key", String),
+)
+
+index = Index("ix_recipe_ingredients_key_recipe_id", recipe_ingredients.c.key, recipe_ingredients.c.recipe_id, postgresql_concurrently=True)
+
+def upgrade(conn: Connection):
+    index.drop(conn, checkfirst=True)
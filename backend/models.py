@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Enum
-from sqlalchemy.orm import relationship
-from sqlalchemy.types import JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, Float, ForeignKey, Enum, Index
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
 from database import Base
+from services.ingredient_parser import parse_ingredient, lookup_key
 import enum
 
 # Recipe model: stores recipe details
@@ -10,9 +10,10 @@ class Recipe(Base):
     __tablename__ = "recipes"
     id = Column(Integer, primary_key=True, index=True)
     recipe_name = Column(String, index=True, unique=True, nullable=False)
-    recipe_ingredients = Column(JSON, nullable=False)
     preperation_time = Column(Integer, nullable=False)
     dish_type = Column(String, nullable=False)
+    # Normalized dish_type, searched by prefix with an index range scan instead of ILIKE '%...%'
+    dish_type_key = Column(String, nullable=False, server_default="")
     calories = Column(Integer, nullable=False)
     image_url = Column(String, nullable=True)
 
@@ -22,6 +23,63 @@ class Recipe(Base):
     # favorited_by establishes a many-to-one relationship with User
     favorited_by = relationship("User", back_populates="favorite_recipe", foreign_keys="[User.favorite_recipe_id]")
 
+    # Indexes serving every combination of the search filters
+    __table_args__ = (
+        Index("ix_recipes_dish_type_key_preperation_time", "dish_type_key", "preperation_time"),
+        Index("ix_recipes_preperation_time_calories", "preperation_time", "calories"),
+        Index("ix_recipes_calories", "calories"),
+    )
+
+    @validates("dish_type")
+    def set_dish_type_key(self, key, value):
+        self.dish_type_key = lookup_key(value)
+        return value
+
+    # Ingredient rows are loaded with one batched IN query for all recipes of a result
+    ingredients = relationship("RecipeIngredient", order_by="RecipeIngredient.position",
+                               cascade="all, delete-orphan", lazy="selectin")
+
+    # Ingredients as the list of strings exposed by the API, assigning a list replaces the rows
+    @property
+    def recipe_ingredients(self) -> list[str]:
+        return [ingredient.text for ingredient in self.ingredients]
+
+    @recipe_ingredients.setter
+    def recipe_ingredients(self, values: list[str]):
+        self.ingredients = [
+            RecipeIngredient(position=position, **parse_ingredient(str(value)))
+            for position, value in enumerate(values)
+        ]
+
+# Recipe ingredient model: one typed row per ingredient of a recipe
+class RecipeIngredient(Base):
+    __tablename__ = "recipe_ingredients"
+    id = Column(Integer, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    # Text as entered, name without the quantity/unit and its normalized key.
+    # Not searched, ingredient searches use the IngredientIndex word postings.
+    text = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    quantity = Column(Float, nullable=True)
+    unit = Column(String, nullable=True)
+
+# Ingredient index model: inverted index (posting lists) of ingredient tokens -> recipes
+class IngredientIndex(Base):
+    __tablename__ = "ingredient_index"
+    token = Column(String, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+# Image blob model: reference counted, content-addressed image files
+class ImageBlob(Base):
+    __tablename__ = "image_blobs"
+    hash = Column(String, primary_key=True)
+    path = Column(String, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    # Set when the last reference is dropped, the garbage collector removes the blob after a grace period
+    released_at = Column(DateTime, nullable=True, index=True)
+
 # Role types
 class UserRole(enum.Enum):
     USER = "user"
@@ -43,9 +101,9 @@ class User(Base):
     dob = Column(Date, nullable=True)
     profile_image = Column(String, nullable=True)
     is_verified = Column(Boolean, default=False)
-    verification_token = Column(String, nullable=True)
+    verification_token = Column(String, unique=True, index=True, nullable=True)
     verification_token_expires_at = Column(DateTime, nullable=True)
-    reset_password_token = Column(String, nullable=True)
+    reset_password_token = Column(String, unique=True, index=True, nullable=True)
     reset_password_token_expires_at = Column(DateTime, nullable=True)
     mfa_enabled = Column(Boolean, default=False)
     mfa_last_verified: datetime = Column(DateTime, nullable=True)
@@ -66,7 +124,7 @@ class RefreshToken(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     token = Column(String, unique=True, nullable=False)
-    expires_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="refresh_tokens")
@@ -1,3 +1,28 @@
+import asyncio
+import logging
+import os
 import redis
+import redis.asyncio
+from services.metrics import instrument_redis
 
-r = redis.Redis(host='localhost', port=6379, decode_responses=True)
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+REDIS_STARTUP_TIMEOUT = float(os.getenv("REDIS_STARTUP_TIMEOUT", 1))
+
+# Clients only open connections on first use, init_redis() / close_redis() are called by the application lifespan
+r = instrument_redis(redis.Redis(host='localhost', port=6379, decode_responses=True))
+
+# Async client for code running on the event loop (background workers)
+ar = instrument_redis(redis.asyncio.Redis(host='localhost', port=6379, decode_responses=True))
+
+# Open the first pooled connection at startup instead of on the first request.
+# Redis being down is logged, not fatal: the caches and rate limiter fail open.
+async def init_redis():
+    try:
+        await asyncio.wait_for(ar.ping(), REDIS_STARTUP_TIMEOUT)
+    except (redis.RedisError, asyncio.TimeoutError) as e:
+        logger.warning("Redis is not reachable at startup: %s", e)
+
+async def close_redis():
+    await ar.aclose()
+    r.close()
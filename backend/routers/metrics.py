@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+from services.metrics import render_metrics
+from typing import Optional
+import os
+import secrets
+
+# Prometheus scrape endpoint, kept out of the OpenAPI schema
+router = APIRouter(tags=["Metrics"])
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# GET /metrics -> Request latency, SQL, Redis, bcrypt and connection pool metrics of this worker process
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,14 +1,26 @@
 import json
-from fastapi import APIRouter, HTTPException, Response, Path, Query, Depends, File, UploadFile, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Request, Response, Path, Query, Depends, File, UploadFile, Form, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from auth import get_current_user
 from database import get_db
 from models import Recipe as RecipeModel
-from models import User
+from services.user_cache import UserPrincipal
 from schemas import RecipeResponse
+from services.image_service import generate_derivatives, delete_image_files
+from services.image_store import store_image, release_image
+from services.pagination import encode_cursor, decode_cursor, decode_ranked_cursor
+from services.recipe_serializer import RECIPE_COLUMNS, serialize_recipes, serialize_recipe
+from services.recipe_cache import get_cached_recipe, cache_recipe, get_cached_page, cache_page, invalidate_recipe, invalidate_pages
+from services.recipe_export import export_recipes, EXPORT_MEDIA_TYPES
+from services.bulk_import import BulkImport, ImageArchive, ndjson_lines, upload_chunks
+from services.ingredient_index import index_recipe, reindex_recipe, remove_recipe, matching_recipe_ids, PREFIX_END
+from services import recipe_search
+from services.ingredient_parser import lookup_key
+from starlette.datastructures import UploadFile as FormFile
 from typing import List, Optional
-from uuid import uuid4
-import os
 
 # Routes for managing recipes
 router = APIRouter(
@@ -16,111 +28,259 @@ router = APIRouter(
     tags=["Recipes"]
 )
 
-UPLOAD_DIR = "images"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 MAX_RECIPES = 100
 
+# Order a select of recipe rows by id (or by score, then id, for ranked results) and start it right after the
+# sort key of the cursor, if any.
+# A filtered select is ordered by id + 0, which the primary key can't serve: SQLite has no statistics on how
+# selective a range filter is and would rather walk the whole table in id order than read the filter's index and sort
+# the matches. The walk stops after one page when most recipes match but reads every row when few do, the index costs
+# at most the number of matches. Unfiltered pages walk the primary key, which stops after one page.
+def page_query(query, cursor: Optional[str], score=None):
+
+    if score is not None:
+        query = query.add_columns(score.label("score")).order_by(score, RecipeModel.id)
+        if cursor:
+            last_score, last_id = decode_ranked_cursor(cursor)
+            query = query.where(or_(score > last_score, and_(score == last_score, RecipeModel.id > last_id)))
+        return query
+
+    sort_key = RecipeModel.id if query.whereclause is None else RecipeModel.id + 0
+    query = query.order_by(sort_key)
+    if cursor:
+        query = query.where(sort_key > decode_cursor(cursor))
+    return query
+
+# Fetch one page of recipe rows (see page_query()) and return it with the cursor of the next page.
+# With a cursor the page starts right after the last seen sort key (constant cost at any depth),
+# otherwise offset pagination is used, capped at MAX_RECIPES.
+async def paginate(db: AsyncSession, query, limit: int, offset: int, cursor: Optional[str], score=None):
+
+    if not cursor:
+        if offset >= MAX_RECIPES:
+            return [], None
+
+        limit = min(limit, MAX_RECIPES - offset)
+
+    query = page_query(query, cursor, score)
+    if not cursor:
+        query = query.offset(offset)
+
+    # One extra row tells whether there is a next page
+    recipes = (await db.execute(query.limit(limit + 1))).all()
+
+    if len(recipes) > limit:
+        recipes = recipes[:limit]
+        return recipes, encode_cursor(recipes[-1].id, None if score is None else recipes[-1].score)
+
+    return recipes, None
+
+# Serve a page from the recipe cache, reading it from the database on a miss.
+# The JSON body is built once from plain rows and sent (and cached) as is, without going through RecipeResponse
+# (response_model stays on the routes for the API schema, FastAPI doesn't validate a returned Response).
+# build_query returns the select and its score column (None to order by id), it is only awaited on a miss.
+async def cached_page(db: AsyncSession, kind: str, params: dict, build_query, limit: int, offset: int, cursor: Optional[str]) -> Response:
+
+    params = {**params, "limit": limit, "offset": offset, "cursor": cursor}
+    key, page = await get_cached_page(kind, params)
+
+    if page is None:
+        query, score = await build_query()
+        recipes, next_cursor = await paginate(db, query, limit, offset, cursor, score)
+        page = (await serialize_recipes(db, recipes), next_cursor)
+        await cache_page(key, *page)
+
+    body, next_cursor = page
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(body, media_type="application/json", headers=headers)
+
 # GET / -> list all recipes
+# Pass the X-Next-Cursor header of a page as `cursor` to get the next page (keyset pagination, no depth limit)
 @router.get("/", response_model=List[RecipeResponse])
 async def get_recipes(limit: int = Query(10, gt=0, le=10, description="Max number of recipes to return"),
                       offset: int = Query(0, ge=0, description="Number of recipes to skip from the beginning"),
-                      db: Session = Depends(get_db)):
+                      cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+                      db: AsyncSession = Depends(get_db)):
 
-    if offset >= MAX_RECIPES:
-        return []
+    async def build_query():
+        return select(*RECIPE_COLUMNS), None
 
-    adjusted_limit = min(limit, MAX_RECIPES - offset)
+    return await cached_page(db, "list", {}, build_query, limit, offset, cursor)
 
-    recipes = db.query(RecipeModel).offset(offset).limit(adjusted_limit).all()
-    return recipes
+# GET /export -> download every recipe as NDJSON (one RecipeResponse per line) or CSV, streamed in batches
+@router.get("/export")
+async def export_all_recipes(format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson or csv"),
+                             current_user: UserPrincipal = Depends(get_current_user)):
+
+    return StreamingResponse(
+        export_recipes(format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="recipes.{format}"'}
+    )
 
 # GET /{id} -> get a single recipe by ID
 @router.get("/{id}", response_model=RecipeResponse)
-async def get_recipe_by_id(id: int = Path(description="The ID of the recipe you want to view", gt=0), db: Session = Depends(get_db)):
-    recipe = db.query(RecipeModel).filter(RecipeModel.id == id).first()
+async def get_recipe_by_id(id: int = Path(description="The ID of the recipe you want to view", gt=0), db: AsyncSession = Depends(get_db)):
+    version, body = await get_cached_recipe(id)
 
-    if not recipe:
-        raise HTTPException(status_code=404, detail="Recipe not found")
-    else:
-        return recipe
+    if body is None:
+        recipe = (await db.execute(select(*RECIPE_COLUMNS).where(RecipeModel.id == id))).first()
 
-#GET /search/ -> get specific recipes
-@router.post("/search", response_model=List[RecipeResponse])
-async def get_specific_recipes(limit: int = Query(10, gt=0, le=10, description="Max number of recipes to return"),
-                               offset: int = Query(0, ge=0, description="Number of recipes to skip from the beginning"),
-                               recipe_ingredients: Optional[str] = None, preperation_time: Optional[int] = None,
-                               dish_type: Optional[str] = None, calories: Optional[int] = None, db: Session = Depends(get_db)):
+        if not recipe:
+            raise HTTPException(status_code=404, detail="Recipe not found")
+
+        body = await serialize_recipe(db, recipe)
+        await cache_recipe(id, version, body)
+
+    return Response(body, media_type="application/json")
 
-    query = db.query(RecipeModel)
+# Build the search select from the filters, every filter is served by an index
+# (see Recipe.__table_args__ and tests/test_query_plans.py)
+def search_query(recipe_ingredients: Optional[str], preperation_time: Optional[int], dish_type: Optional[str], calories: Optional[int]):
+
+    query = select(*RECIPE_COLUMNS)
 
     if preperation_time:
-        query = query.filter(RecipeModel.preperation_time <= preperation_time)
-    if dish_type:
-        query = query.filter(RecipeModel.dish_type.ilike(f"%{dish_type}%"))
+        query = query.where(RecipeModel.preperation_time <= preperation_time)
+    if dish_type and lookup_key(dish_type):
+        # Prefix match on the normalized dish type ("main" matches "Main course")
+        key = lookup_key(dish_type)
+        query = query.where(RecipeModel.dish_type_key >= key, RecipeModel.dish_type_key < key + PREFIX_END)
     if calories:
-        query = query.filter(RecipeModel.calories <= calories)
+        query = query.where(RecipeModel.calories <= calories)
     if recipe_ingredients:
         try:
             ingredients = json.loads(recipe_ingredients)
-            for ingredient in ingredients:
-                query = query.filter(RecipeModel.recipe_ingredients.like(f"%{ingredient}%"))
-        except:
-            pass
+        except ValueError:
+            ingredients = []
+
+        if isinstance(ingredients, str):
+            ingredients = [ingredients]
+
+        if isinstance(ingredients, list):
+            recipe_ids = matching_recipe_ids(ingredients)
+            if recipe_ids is not None:
+                query = query.where(RecipeModel.id.in_(recipe_ids))
+
+    return query
+
+# Ingredients of the create and update forms, a JSON list of strings
+def parse_ingredients(recipe_ingredients: str) -> list[str]:
+    try:
+        ingredients = json.loads(recipe_ingredients)
+    except ValueError:
+        ingredients = None
 
-    if offset >= MAX_RECIPES:
-        return []
+    if not isinstance(ingredients, list) or not all(isinstance(ingredient, str) for ingredient in ingredients):
+        raise HTTPException(status_code=400, detail="recipe_ingredients must be a JSON list of strings")
 
-    adjusted_limit = min(limit, MAX_RECIPES - offset)
+    return ingredients
+
+#GET /search/ -> get specific recipes
+@router.post("/search", response_model=List[RecipeResponse])
+async def get_specific_recipes(limit: int = Query(10, gt=0, le=10, description="Max number of recipes to return"),
+                               offset: int = Query(0, ge=0, description="Number of recipes to skip from the beginning"),
+                               cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+                               q: Optional[str] = Query(None, max_length=200, description="Free text matched against names, dish types and ingredients, results ranked by relevance"),
+                               recipe_ingredients: Optional[str] = None, preperation_time: Optional[int] = None,
+                               dish_type: Optional[str] = None, calories: Optional[int] = None, db: AsyncSession = Depends(get_db)):
 
-    recipes = query.offset(offset).limit(adjusted_limit).all()
-    return recipes
+    async def build_query():
+        query = search_query(recipe_ingredients, preperation_time, dish_type, calories)
+        if not q:
+            return query, None
+
+        matches = await recipe_search.text_matches(db, q)
+        if matches is None:
+            return query, None
+
+        return query.join(matches, matches.c.id == RecipeModel.id), matches.c.score
+
+    search_params = {
+        "q": q, "recipe_ingredients": recipe_ingredients, "preperation_time": preperation_time,
+        "dish_type": dish_type, "calories": calories
+    }
+
+    return await cached_page(db, "search", search_params, build_query, limit, offset, cursor)
 
 
 # POST / -> create a new recipe
 @router.post("/", response_model=RecipeResponse)
 async def create_recipe(recipe_name: str = Form(...), recipe_ingredients: str = Form(...),
                         preperation_time: int = Form(...), dish_type: str = Form(...),
-                        calories: int = Form(...), image: UploadFile = File(),
-                        current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+                        calories: int = Form(...), image: UploadFile = File(), background_tasks: BackgroundTasks = None,
+                        current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
 
-    if db.query(RecipeModel).filter(RecipeModel.recipe_name == recipe_name).first():
-        raise HTTPException(status_code=400, detail="Recipe already exists")
-
-    if not image.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    ingredients = parse_ingredients(recipe_ingredients)
 
-    filename = f"{uuid4()}_{image.filename}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    if await db.scalar(select(RecipeModel.id).where(RecipeModel.recipe_name == recipe_name)):
+        raise HTTPException(status_code=400, detail="Recipe already exists")
 
     try:
-        contents = await image.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-    except Exception as e:
+        image_path = await store_image(db, image)
+    except OSError as e:
         raise HTTPException(status_code=500, detail=f"Failed to save image: {str(e)}")
 
-    image_url = f"/{UPLOAD_DIR}/{filename}"
+    background_tasks.add_task(generate_derivatives, image_path)
+
+    image_url = f"/{image_path}"
 
     new_recipe = RecipeModel(
-                            recipe_name=recipe_name, recipe_ingredients=json.loads(recipe_ingredients),
+                            recipe_name=recipe_name, recipe_ingredients=ingredients,
                             preperation_time=preperation_time, dish_type=dish_type, calories=calories,
                             image_url=image_url, owner_id=current_user.id
                             )
 
     db.add(new_recipe)
-    db.commit()
-    db.refresh(new_recipe)
+    await db.flush()
+    index_recipe(db, new_recipe)
+    await recipe_search.index_recipe(db, recipe_search.recipe_document(new_recipe))
+    await db.commit()
+    await invalidate_recipe(new_recipe.id)
     return new_recipe
 
+# POST /bulk -> import recipes from NDJSON, one schemas.Recipe object per line, owned by the current user.
+# Send the lines as the request body (Content-Type: application/x-ndjson), they are imported while they arrive.
+# To import images too, send multipart form data with the lines in a `recipes` file and a zip archive in `images`,
+# each line naming its file of the archive in an "image" field. Those lines are only imported once the whole
+# request was received, the body (lines and archive) is limited to BULK_IMPORT_MAX_BODY_SIZE.
+# Returns counts of created, duplicate (name already taken or repeated in the file) and failed lines.
+@router.post("/bulk")
+async def import_recipes(request: Request, background_tasks: BackgroundTasks,
+                         current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        try:
+            recipes, images = form.get("recipes"), form.get("images")
+            if not isinstance(recipes, FormFile):
+                raise HTTPException(status_code=400, detail="recipes must be an NDJSON file")
+
+            archive = await ImageArchive.open(images) if isinstance(images, FormFile) else None
+            bulk_import = BulkImport(db, current_user.id, archive)
+            report = await bulk_import.run(ndjson_lines(upload_chunks(recipes)))
+        finally:
+            await form.close()
+    else:
+        bulk_import = BulkImport(db, current_user.id)
+        report = await bulk_import.run(ndjson_lines(request.stream()))
+
+    for image_path in set(bulk_import.image_paths):
+        background_tasks.add_task(generate_derivatives, image_path)
+
+    if report["created"]:
+        await invalidate_pages()
+
+    return report
+
 # PUT /{id} -> update an existing recipe
 @router.put("/{id}", response_model=RecipeResponse)
 async def update_recipe(id: int, recipe_name: Optional[str] = Form(None), recipe_ingredients: Optional[str] = Form(None),
                         preperation_time: Optional[int] = Form(None), dish_type: Optional[str] = Form(None),
-                        calories: Optional[int] = Form(None), image: Optional[UploadFile] = File(None),
-                        current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+                        calories: Optional[int] = Form(None), image: Optional[UploadFile] = File(None), background_tasks: BackgroundTasks = None,
+                        current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
 
-    recipe = db.query(RecipeModel).filter(RecipeModel.id == id).first()
+    recipe = await db.scalar(select(RecipeModel).where(RecipeModel.id == id))
 
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
@@ -128,10 +288,13 @@ async def update_recipe(id: int, recipe_name: Optional[str] = Form(None), recipe
     if current_user.id != recipe.owner_id:
         raise HTTPException(status_code=403, detail="You are not the owner of this recipe")
 
+    indexed = recipe_search.recipe_document(recipe)
+
     if recipe_name:
         recipe.recipe_name = recipe_name
     if recipe_ingredients:
-        recipe.recipe_ingredients = json.loads(recipe_ingredients)
+        recipe.recipe_ingredients = parse_ingredients(recipe_ingredients)
+        await reindex_recipe(db, recipe)
     if preperation_time:
         recipe.preperation_time = preperation_time
     if dish_type:
@@ -139,35 +302,33 @@ async def update_recipe(id: int, recipe_name: Optional[str] = Form(None), recipe
     if calories:
         recipe.calories = calories
     if image:
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-
-        if recipe.image_url:
-            old_file_path = recipe.image_url.lstrip("/")
-            if os.path.exists(old_file_path):
-                try:
-                    os.remove(old_file_path)
-                except Exception as e:
-                    raise HTTPException(status_code=500, detail=f"Failed to delete old image: {str(e)}")
-
-        filename = f"{uuid4()}_{image.filename}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
         try:
-            contents = await image.read()
-            with open(file_path, "wb") as f:
-                f.write(contents)
-        except Exception as e:
+            image_path = await store_image(db, image)
+        except OSError as e:
             raise HTTPException(status_code=500, detail=f"Failed to save new image: {str(e)}")
-        recipe.image_url = f"/{UPLOAD_DIR}/{filename}"
 
-    db.commit()
-    db.refresh(recipe)
+        # Images saved before the blob store existed are not reference counted and are deleted right away
+        if recipe.image_url and not await release_image(db, recipe.image_url):
+            try:
+                delete_image_files(recipe.image_url.lstrip("/"))
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to delete old image: {str(e)}")
+
+        background_tasks.add_task(generate_derivatives, image_path)
+        recipe.image_url = f"/{image_path}"
+
+    if recipe_name or recipe_ingredients or dish_type:
+        await recipe_search.reindex_recipe(db, indexed, recipe_search.recipe_document(recipe))
+
+    await db.commit()
+    await invalidate_recipe(recipe.id)
     return recipe
 
 # DELETE /{id} -> delete a recipe
 @router.delete("/{id}")
-async def delete_recipe(id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    recipe = db.query(RecipeModel).filter(RecipeModel.id == id).first()
+async def delete_recipe(id: int, current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Users favoriting the recipe are loaded up front so the delete can clear their favorite_recipe_id
+    recipe = await db.scalar(select(RecipeModel).options(selectinload(RecipeModel.favorited_by)).where(RecipeModel.id == id))
 
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
@@ -175,14 +336,15 @@ async def delete_recipe(id: int, current_user: User = Depends(get_current_user),
     if current_user.id != recipe.owner_id:
         raise HTTPException(status_code=403, detail="You are not the owner of this recipe")
 
-    if recipe.image_url:
-        file_path = recipe.image_url.lstrip("/")
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Failed to delete an image: {str(e)}")
+    if recipe.image_url and not await release_image(db, recipe.image_url):
+        try:
+            delete_image_files(recipe.image_url.lstrip("/"))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to delete an image: {str(e)}")
 
-    db.delete(recipe)
-    db.commit()
+    await remove_recipe(db, recipe.id)
+    await recipe_search.remove_recipe(db, recipe_search.recipe_document(recipe))
+    await db.delete(recipe)
+    await db.commit()
+    await invalidate_recipe(id)
     return Response(status_code=204)
\ No newline at end of file
@@ -1,20 +1,23 @@
-from fastapi import APIRouter, Path, HTTPException, Depends, Cookie, Request, UploadFile, File, Form
+from fastapi import APIRouter, Path, HTTPException, Depends, Cookie, Header, Request, UploadFile, File, Form, BackgroundTasks
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import EmailStr
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User, UserRole, Recipe, RefreshToken
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_pool_stats
+from models import User, UserRole, Recipe
 from schemas import CreateUser, UserResponse, UserProfileResponse, RecipeResponse, LoginUser, VerifyEmail, ResendEmail, ForgotPasswordRequest, ResetPasswordRequest, MfaSetupRequest, MfaVerifyRequest
-from passlib.context import CryptContext
-from auth import create_access_token, create_refresh_token, create_mfa_token, verify_mfa_token, delete_expired_refresh_tokens, get_current_user_optional, get_current_user
-from services.email_service import send_verification_email, send_reset_password_email
+from auth import create_access_token, create_refresh_token, create_mfa_token, verify_mfa_token, get_current_user_optional, get_current_user
+from services.email_service import send_verification_email, send_reset_password_email, preferred_locale
+from services.mail_queue import get_mail_queue_stats
+from services.user_cache import UserPrincipal, invalidate_user
+from services.token_store import refresh_token_store
+from services.token_service import generate_token, hash_token
 from services.brute_force import check_login_limits, reset_login_attempts
-from services.file_service import save_profile_image
+from services.image_service import generate_derivatives
+from services.image_store import store_image
+from services.password_service import hash_password, verify_password
 from typing import Optional
 from datetime import datetime, timedelta, date
-import secrets
-import pyotp
-import qrcode
 import io
 import os
 
@@ -24,14 +27,12 @@ router = APIRouter(
     tags=["Users"]
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 
 # GET -> get current user
 @router.get("/me", response_model=Optional[UserResponse])
-def get_me(current_user: Optional[User] = Depends(get_current_user_optional)):
+async def get_me(current_user: Optional[UserPrincipal] = Depends(get_current_user_optional)):
 
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -41,16 +42,19 @@ def get_me(current_user: Optional[User] = Depends(get_current_user_optional)):
 # POST /register -> create a new user with hashed password
 @router.post("/register")
 async def register_user(user_data: CreateUser = Depends(CreateUser.as_form),
-                        profile_image: UploadFile = File(None), db: Session = Depends(get_db)):
+                        profile_image: UploadFile = File(None), background_tasks: BackgroundTasks = None,
+                        accept_language: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
 
-    if db.query(User).filter((User.username == user_data.username) | (User.email == user_data.email)).first():
+    if await db.scalar(select(User.id).where((User.username == user_data.username) | (User.email == user_data.email))):
         raise HTTPException(status_code=400, detail="User already exists")
 
-    hashed_password = pwd_context.hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
 
-    profile_image_path = save_profile_image(profile_image) if profile_image else None
+    profile_image_path = await store_image(db, profile_image) if profile_image else None
+    if profile_image_path:
+        background_tasks.add_task(generate_derivatives, profile_image_path)
 
-    token = secrets.token_urlsafe(32)
+    token, token_digest = generate_token()
 
     new_user = User(
         username=user_data.username,
@@ -64,7 +68,7 @@ async def register_user(user_data: CreateUser = Depends(CreateUser.as_form),
         dob=user_data.dob,
         profile_image=profile_image_path,
         is_verified=False,
-        verification_token=token, 
+        verification_token=token_digest,
         verification_token_expires_at = datetime.utcnow() + timedelta(minutes=30),
         reset_password_token=None,
         reset_password_token_expires_at = None,
@@ -72,18 +76,17 @@ async def register_user(user_data: CreateUser = Depends(CreateUser.as_form),
         )
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
 
-    await send_verification_email(new_user.email, token)
+    await send_verification_email(new_user.email, token, preferred_locale(accept_language))
 
     return {"message" : "Registration successful. Please check your email to verify your account."}
 
 #POST /verify-email -> email verification for registered users
 @router.post("/verify-email")
-async def verify_email(token: VerifyEmail, db: Session = Depends(get_db)):
+async def verify_email(token: VerifyEmail, db: AsyncSession = Depends(get_db)):
 
-    user = db.query(User).filter(User.verification_token == token.token).first()
+    user = await db.scalar(select(User).where(User.verification_token == hash_token(token.token)))
 
     if not user:
         raise HTTPException( status_code=400, detail="Invalid or used verification link")
@@ -96,28 +99,29 @@ async def verify_email(token: VerifyEmail, db: Session = Depends(get_db)):
     user.verification_token = None
     user.verification_token_expires_at = None
 
-    db.commit()
+    await db.commit()
+    await invalidate_user(user.id)
 
     return {"message": "Email successfully verified"}
 
 #POST /resend-verification -> resend email verification for registered users
 @router.post("/resend-verification")
-async def resend_verification(email: ResendEmail, db: Session = Depends(get_db)):
+async def resend_verification(email: ResendEmail, accept_language: Optional[str] = Header(None),
+                              db: AsyncSession = Depends(get_db)):
 
-    user = db.query(User).filter(User.email == email.email).first()
+    user = await db.scalar(select(User).where(User.email == email.email))
 
     if not user or user.is_verified:
         return {
             "message": "If the account exists, a verification email has been sent."
         }
 
-    new_token = secrets.token_urlsafe(32)
-    user.verification_token = new_token
+    new_token, user.verification_token = generate_token()
     user.verification_token_expires_at = datetime.utcnow() + timedelta(minutes=30)
     
-    db.commit()
+    await db.commit()
 
-    await send_verification_email(user.email, new_token)
+    await send_verification_email(user.email, new_token, preferred_locale(accept_language))
 
     return {
         "message": "If the account exists, a verification email has been sent."
@@ -126,27 +130,34 @@ async def resend_verification(email: ResendEmail, db: Session = Depends(get_db))
 
 # POST /login -> Log in into your account
 @router.post("/login")
-async def login_user(login_user: LoginUser, request: Request, db: Session = Depends(get_db)):
+async def login_user(login_user: LoginUser, request: Request, db: AsyncSession = Depends(get_db)):
 
     ip = request.client.host
 
     #Brute force check
-    check_login_limits(login_user.username, ip)
+    await check_login_limits(login_user.username, ip)
 
-    user = db.query(User).filter(User.username == login_user.username).first()
+    user = await db.scalar(select(User).where(User.username == login_user.username))
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    if not pwd_context.verify(login_user.password, user.password_hash):
+    valid, new_hash = await verify_password(login_user.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+    # Transparently upgrade hashes made with outdated cost parameters
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+        await invalidate_user(user.id)
+
     if not user.is_verified:
         raise HTTPException(
             status_code=403,
             detail="Please verify your email before logging in"
         )
 
-    reset_login_attempts(login_user.username)
+    await reset_login_attempts(login_user.username)
 
     if user.mfa_enabled:
         if not user.mfa_last_verified or datetime.utcnow() - user.mfa_last_verified > timedelta(days=7):
@@ -154,7 +165,7 @@ async def login_user(login_user: LoginUser, request: Request, db: Session = Depe
             return {"mfa_required": True, "mfa_token": temp_token}
 
     access_token = create_access_token({"user_id": user.id, "type" : "access"})
-    refresh_token = create_refresh_token(user, db)
+    refresh_token = await create_refresh_token(user, db)
 
     response = JSONResponse(content={"message": "Login successful"})
     response.set_cookie(
@@ -179,19 +190,23 @@ async def login_user(login_user: LoginUser, request: Request, db: Session = Depe
 
 #POST /mfa/setup make secret key and generate qrcode
 @router.post("/mfa/setup")
-def mfa_setup(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def mfa_setup(current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
 
-    user = db.query(User).filter(User.id == current_user.userId).first()
+    user = await db.scalar(select(User).where(User.id == current_user.id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     if user.mfa_enabled:
         raise HTTPException(400, "MFA already enabled")
 
+    # MFA is rarely used, its libraries are only imported when needed
+    import pyotp
+    import qrcode
+
     secret = pyotp.random_base32()
     user.mfa_secret = secret
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await invalidate_user(user.id)
 
     uri = pyotp.totp.TOTP(secret).provisioning_uri(
         name=user.username,
@@ -207,9 +222,11 @@ def mfa_setup(current_user: User = Depends(get_current_user), db: Session = Depe
 
 #POST /mfa/verify-setup Called only once, after enabling mfa
 @router.post("/mfa/verify-setup")
-def verify_mfa_setup(data: MfaSetupRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def verify_mfa_setup(data: MfaSetupRequest, current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+
+    import pyotp
 
-    user = db.query(User).filter(User.id == current_user.userId).first()
+    user = await db.scalar(select(User).where(User.id == current_user.id))
     if not user or not user.mfa_secret:
         raise HTTPException(status_code=400, detail="MFA not setup")
 
@@ -219,21 +236,24 @@ def verify_mfa_setup(data: MfaSetupRequest, current_user: User = Depends(get_cur
 
     user.mfa_enabled = True
     user.mfa_last_verified = datetime.utcnow()
-    db.commit()
+    await db.commit()
+    await invalidate_user(user.id)
 
     return {"message": "MFA enabled successfully"}
 
 
 #POST /mfa/verify verification of the code of 6 digits
 @router.post("/mfa/verify-login")
-def verify_mfa(data: MfaVerifyRequest, db: Session = Depends(get_db)):
+async def verify_mfa(data: MfaVerifyRequest, db: AsyncSession = Depends(get_db)):
 
     try:
         user_id = verify_mfa_token(data.mfa_token)
     except:
         raise HTTPException(status_code=401, detail="Invalid or expired MFA token")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    import pyotp
+
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user or not user.mfa_secret:
         raise HTTPException(status_code=400, detail="MFA not setup")
 
@@ -242,11 +262,10 @@ def verify_mfa(data: MfaVerifyRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=401, detail="Invalid MFA code")
 
     user.mfa_last_verified = datetime.utcnow()
-    db.commit()
-    db.refresh(user)
+    await db.commit()
 
     access_token = create_access_token({"user_id": user.id, "type" : "access"})
-    refresh_token = create_refresh_token(user, db)
+    refresh_token = await create_refresh_token(user, db)
 
     response = JSONResponse({"message": "Login successful"})
     response.set_cookie(
@@ -272,25 +291,19 @@ def verify_mfa(data: MfaVerifyRequest, db: Session = Depends(get_db)):
 
 #POST /refresh -> Create new access token using refresh token
 @router.post("/refresh")
-async def refresh_token_endpoint(refresh_token: str = Cookie(None), db: Session = Depends(get_db)):
+async def refresh_token_endpoint(refresh_token: str = Cookie(None), db: AsyncSession = Depends(get_db)):
 
     if not refresh_token:
         raise HTTPException(status_code=401, detail="Refresh token missing")
 
-    delete_expired_refresh_tokens(db)
-
-    token_obj = db.query(RefreshToken).filter(RefreshToken.token == refresh_token).first()
-    if not token_obj or token_obj.expires_at < datetime.utcnow():
+    # Rotate refresh token for security
+    rotated = await refresh_token_store.rotate(db, refresh_token)
+    if not rotated:
         raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
 
-    user = token_obj.user
-
-    # Rotate refresh token for security
-    db.delete(token_obj)
-    db.commit()
-    new_refresh_token = create_refresh_token(user, db)
+    user_id, new_refresh_token = rotated
 
-    access_token = create_access_token({"user_id": token_obj.user_id, "type" : "access"})
+    access_token = create_access_token({"user_id": user_id, "type" : "access"})
 
     response = JSONResponse(content={"message": "Access token refreshed"})
     response.set_cookie(
@@ -313,17 +326,17 @@ async def refresh_token_endpoint(refresh_token: str = Cookie(None), db: Session
 
 #POST /forgot-password -> Send a forgot password form link to user email
 @router.post("/forgot-password")
-async def forgot_password(email: ForgotPasswordRequest, db: Session = Depends(get_db)):
+async def forgot_password(email: ForgotPasswordRequest, accept_language: Optional[str] = Header(None),
+                          db: AsyncSession = Depends(get_db)):
     
-    user = db.query(User).filter(User.email == email.email).first()
+    user = await db.scalar(select(User).where(User.email == email.email))
 
     if user and user.is_verified:
-        token = secrets.token_urlsafe(32)
-        user.reset_password_token = token
+        token, user.reset_password_token = generate_token()
         user.reset_password_token_expires_at = datetime.utcnow() + timedelta(minutes=30)
-        db.commit()
+        await db.commit()
 
-        await send_reset_password_email(user.email, token)
+        await send_reset_password_email(user.email, token, preferred_locale(accept_language))
 
     return {
         "message": "If the account exists, a password reset email has been sent."
@@ -331,11 +344,11 @@ async def forgot_password(email: ForgotPasswordRequest, db: Session = Depends(ge
 
 #POST /reset-password -> Reset your password
 @router.post("/reset-password")
-async def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_db)):
+async def reset_password(data: ResetPasswordRequest, db: AsyncSession = Depends(get_db)):
     
-    user = db.query(User).filter(
-        User.reset_password_token == data.token
-    ).first()
+    user = await db.scalar(select(User).where(
+        User.reset_password_token == hash_token(data.token)
+    ))
 
     if not user:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
@@ -343,29 +356,45 @@ async def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_d
     if user.reset_password_token_expires_at < datetime.utcnow():
         raise HTTPException(status_code=400, detail="Reset token has expired")
 
-    user.password_hash = pwd_context.hash(data.new_password)
+    user.password_hash = await hash_password(data.new_password)
 
     user.reset_password_token = None
     user.reset_password_token_expires_at = None
 
-    db.commit()
+    await db.commit()
+    await invalidate_user(user.id)
 
     return {"message": "Password has been successfully reset"}
 
+# GET /admin/mail-queue -> Outbound mail queue depth and counters (admin only)
+@router.get("/admin/mail-queue")
+async def mail_queue_stats(current_user: UserPrincipal = Depends(get_current_user)):
+
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    return await get_mail_queue_stats()
+
+# GET /admin/db-pool -> Database connection pool usage and checkout wait times (admin only)
+@router.get("/admin/db-pool")
+async def db_pool_stats(current_user: UserPrincipal = Depends(get_current_user)):
+
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    return get_pool_stats()
+
 # GET /profile -> Get user profile info
 @router.get("/profile", response_model=UserProfileResponse)
-def get_user_profile(current_user: User = Depends(get_current_user)):
-    return current_user
+async def get_user_profile(current_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await db.scalar(select(User).where(User.id == current_user.id))
 
 # POST /logout -> Log out and return to home page
 @router.post("/logout")
-def logout_user(refresh_token: str = Cookie(None), db: Session = Depends(get_db)):
+async def logout_user(refresh_token: str = Cookie(None), db: AsyncSession = Depends(get_db)):
 
     if refresh_token:
-        token_obj = db.query(RefreshToken).filter(RefreshToken.token == refresh_token).first()
-        if token_obj:
-            db.delete(token_obj)
-            db.commit()
+        await refresh_token_store.revoke(db, refresh_token)
 
     response = JSONResponse(content={"message": "Logged out successfully"})
     response.delete_cookie(key="access_token")
@@ -374,25 +403,25 @@ def logout_user(refresh_token: str = Cookie(None), db: Session = Depends(get_db)
 
 # GET /{user_id}/favorite -> get user's favorite recipe
 @router.get("/{user_id}/favorite", response_model=RecipeResponse)
-def get_favorite_recipe(user_id: int = Path(description="The ID of the user whose favorite recipe you want to see", gt=0),
-                        db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_favorite_recipe(user_id: int = Path(description="The ID of the user whose favorite recipe you want to see", gt=0),
+                        db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
 
     if user:
         if user.favorite_recipe_id is None:
             raise HTTPException(status_code=404, detail="User has no favorite recipe")
         else:
-            return user.favorite_recipe
+            return await db.scalar(select(Recipe).where(Recipe.id == user.favorite_recipe_id))
     else:
         raise HTTPException(status_code=404, detail="User not found")
 
 # POST /{user_id}/favorite/{recipe_id} -> mark a recipe as favorite for user
 @router.post("/{user_id}/favorite/{recipe_id}")
-def mark_favorite_recipe(user_id: int = Path(description="The ID of the user you want to tag a favorite recipe to", gt=0),
+async def mark_favorite_recipe(user_id: int = Path(description="The ID of the user you want to tag a favorite recipe to", gt=0),
                          recipe_id: int = Path(description="The ID of the recipe you want to mark as a favorite", gt=0)
-                         , db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
+                         , db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
+    recipe = await db.scalar(select(Recipe).where(Recipe.id == recipe_id))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -400,18 +429,17 @@ def mark_favorite_recipe(user_id: int = Path(description="The ID of the user you
         raise HTTPException(status_code=404, detail="Recipe not found")
 
     user.favorite_recipe_id = recipe_id
-    db.commit()
-    db.refresh(recipe)
+    await db.commit()
 
     return {"message": "Recipe marked as favorite"}
 
 # PUT /{user_id}/favorite/{new_recipe_id} -> change user's favorite recipe
 @router.put("/{user_id}/favorite/{new_recipe_id}")
-def update_favorite_recipe(user_id: int = Path(description="The ID of the user you want to change a favorite recipe", gt=0),
+async def update_favorite_recipe(user_id: int = Path(description="The ID of the user you want to change a favorite recipe", gt=0),
                          new_recipe_id: int = Path(description="The ID of the new recipe you want to mark as a favorite", gt=0)
-                         , db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    recipe = db.query(Recipe).filter(Recipe.id == new_recipe_id).first()
+                         , db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
+    recipe = await db.scalar(select(Recipe).where(Recipe.id == new_recipe_id))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -419,22 +447,20 @@ def update_favorite_recipe(user_id: int = Path(description="The ID of the user y
         raise HTTPException(status_code=404, detail="Recipe not found")
 
     user.favorite_recipe_id = new_recipe_id
-    db.commit()
-    db.refresh(recipe)
+    await db.commit()
 
     return {"message": "New recipe marked as favorite"}
 
 # DELETE /{user_id}/favorite -> remove user's favorite recipe
 @router.delete("/{user_id}/favorite")
-def delete_favorite_recipe(user_id: int = Path(description="The ID of the user whose favorite recipe you want to delete", gt=0),
-                           db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def delete_favorite_recipe(user_id: int = Path(description="The ID of the user whose favorite recipe you want to delete", gt=0),
+                           db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     user.favorite_recipe_id = None
-    db.commit()
-    db.refresh(user)
+    await db.commit()
 
     return {"message": "Favorite recipe deleted"}
@@ -1,7 +1,8 @@
 from datetime import date
 
 from fastapi import Form
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, computed_field
+from services.image_service import variant_urls
 from typing import Optional, List
 
 # Recipe: request model for creating a recipe
@@ -30,6 +31,12 @@ class RecipeResponse(BaseModel):
     calories: int
     image_url : Optional[str] = None
 
+    # URLs of the thumbnail and re-encoded versions of the image
+    @computed_field
+    @property
+    def image_variants(self) -> dict[str, str]:
+        return variant_urls(self.image_url)
+
     class Config:
         from_attributes = True
 
@@ -106,5 +113,11 @@ class UserProfileResponse(BaseModel):
     profile_image: Optional[str]
     mfa_enabled: bool
 
+    # URLs of the thumbnail and re-encoded versions of the profile image
+    @computed_field
+    @property
+    def profile_image_variants(self) -> dict[str, str]:
+        return variant_urls(self.profile_image)
+
     class Config:
         from_attributes = True
\ No newline at end of file
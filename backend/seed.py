@@ -1,10 +1,8 @@
 from models import User, UserRole
 from database import SessionLocal
-from passlib.context import CryptContext
+from services.password_service import pwd_context
 import os
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 def seed_admin():
     db = SessionLocal()
     try:
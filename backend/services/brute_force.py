@@ -1,33 +1,142 @@
 from fastapi import HTTPException
-from redis_client import r
+from redis_client import ar
+from collections import deque
+import math
 import os
+import secrets
+import time
 
 #Borders
 username_limit = int(os.getenv("USERNAME_LIMIT"))
 ip_limit = int(os.getenv("IP_LIMIT"))
+username_window = int(os.getenv("USERNAME_WINDOW", 600))
+ip_window = int(os.getenv("IP_WINDOW", 300))
 
-#Check if there is any login limits
-def check_login_limits(username : str, ip : str):
+# Sliding window log over sorted sets, checked and recorded atomically for all keys in one round trip.
+# KEYS: counters, ARGV: now_ms, member, then limit and window_ms for every key.
+# Returns {retry_after_ms, remaining, index of the first key over its limit (0 when allowed),
+# index of the key with the fewest requests left, ms until that key's window is empty}.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local member = ARGV[2]
+local retry_after = 0
+local blocked = 0
+local remaining = -1
+local tightest = 1
+local reset = 0
 
-    username_key = f"login:email:{username}"
-    ip_key = f"login:ip:{ip}"
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[1 + 2 * i])
+    local window = tonumber(ARGV[2 + 2 * i])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local wait = window
+    if oldest[2] then wait = tonumber(oldest[2]) + window - now end
 
-    username_attempts = r.get(username_key)
-    ip_attempts = r.get(ip_key)
+    if count >= limit then
+        if blocked == 0 then blocked = i end
+        if wait > retry_after then retry_after = wait end
+    elseif remaining < 0 or limit - count - 1 < remaining then
+        remaining = limit - count - 1
+        tightest = i
+        reset = wait
+    end
+end
 
-    if username_attempts and int(username_attempts) >= username_limit:
-        raise HTTPException(429, "Account temporarily locked")
+if blocked > 0 then
+    return {retry_after, 0, blocked, blocked, retry_after}
+end
 
-    if ip_attempts and int(ip_attempts) >= ip_limit:
-        raise HTTPException(429, "To many requests from this IP")
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, member)
+    redis.call('PEXPIRE', key, tonumber(ARGV[2 + 2 * i]))
+end
 
-    r.incr(username_key)
-    r.expire(username_key, 600)
+return {0, remaining, 0, tightest, reset}
+"""
 
-    r.incr(ip_key)
-    r.expire(ip_key, 300)
+# Result of a limiter hit: retry_after in seconds (0 when allowed), requests left, which rule blocked (-1 if none),
+# and the limit and reset time (seconds) of the most restrictive rule, used for X-RateLimit-* headers
+class LimitResult:
 
-# Reset after successfull login
-def reset_login_attempts(username : str):
-    r.delete(f"login:email:{username}")
+    def __init__(self, retry_after: int, remaining: int, blocked: int, limit: int = 0, reset: int = 0):
+        self.retry_after = retry_after
+        self.remaining = remaining
+        self.blocked = blocked
+        self.limit = limit
+        self.reset = reset
+
+    @property
+    def allowed(self) -> bool:
+        return self.blocked < 0
+
+# Limiter state shared by all workers through Redis
+class RedisLimiterBackend:
+
+    def __init__(self):
+        self.script = ar.register_script(SLIDING_WINDOW_SCRIPT)
+
+    async def hit(self, rules: list[tuple[str, int, int]]) -> LimitResult:
+        args = [int(time.time() * 1000), secrets.token_hex(8)]
+        for _, limit, window in rules:
+            args += [limit, window * 1000]
+
+        retry_after_ms, remaining, blocked, tightest, reset_ms = await self.script(keys=[key for key, _, _ in rules], args=args)
+        return LimitResult(math.ceil(retry_after_ms / 1000), remaining, blocked - 1, rules[tightest - 1][1], math.ceil(reset_ms / 1000))
+
+    async def reset(self, key: str):
+        await ar.delete(key)
+
+# In-process limiter with the same semantics, for tests and single worker development setups
+class MemoryLimiterBackend:
+
+    def __init__(self):
+        self.windows: dict[str, deque] = {}
+
+    async def hit(self, rules: list[tuple[str, int, int]]) -> LimitResult:
+        now = time.monotonic()
+        retry_after, remaining, blocked, tightest, reset = 0.0, -1, -1, 0, 0.0
+
+        for i, (key, limit, window) in enumerate(rules):
+            hits = self.windows.setdefault(key, deque())
+            while hits and hits[0] <= now - window:
+                hits.popleft()
 
+            wait = hits[0] + window - now if hits else window
+            if len(hits) >= limit:
+                blocked = i if blocked < 0 else blocked
+                retry_after = max(retry_after, wait)
+            elif remaining < 0 or limit - len(hits) - 1 < remaining:
+                remaining, tightest, reset = limit - len(hits) - 1, i, wait
+
+        if blocked >= 0:
+            return LimitResult(math.ceil(retry_after), 0, blocked, rules[blocked][1], math.ceil(retry_after))
+
+        for key, _, _ in rules:
+            self.windows[key].append(now)
+
+        return LimitResult(0, remaining, -1, rules[tightest][1], math.ceil(reset))
+
+    async def reset(self, key: str):
+        self.windows.pop(key, None)
+
+limiter = MemoryLimiterBackend() if os.getenv("RATE_LIMIT_BACKEND") == "memory" else RedisLimiterBackend()
+
+#Check if there is any login limits
+async def check_login_limits(username : str, ip : str):
+
+    result = await limiter.hit([
+        (f"ratelimit:login:username:{username}", username_limit, username_window),
+        (f"ratelimit:login:ip:{ip}", ip_limit, ip_window),
+    ])
+
+    if result.blocked == 0:
+        raise HTTPException(429, "Account temporarily locked", headers={"Retry-After": str(result.retry_after)})
+
+    if result.blocked == 1:
+        raise HTTPException(429, "To many requests from this IP", headers={"Retry-After": str(result.retry_after)})
+
+# Reset after successfull login
+async def reset_login_attempts(username : str):
+    await limiter.reset(f"ratelimit:login:username:{username}")
@@ -0,0 +1,271 @@
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from models import Recipe, RecipeIngredient, IngredientIndex
+from schemas import Recipe as RecipeSchema
+from database import run_rollback_callbacks
+from services.file_service import stage_image_upload, CHUNK_SIZE
+from services.image_store import store_staged_image
+from services.ingredient_index import tokenize
+from services.ingredient_parser import parse_ingredient, lookup_key
+from services.recipe_search import document, index_recipes
+from collections import Counter
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import orjson
+import os
+import zipfile
+
+# Recipes inserted per transaction, each chunk costs one duplicate check and three INSERT statements
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", 500))
+# Request body limit of the import endpoint (NDJSON plus the image archive), replaces MAX_REQUEST_BODY_SIZE there
+BULK_IMPORT_MAX_BODY_SIZE = int(os.getenv("BULK_IMPORT_MAX_BODY_SIZE", 512 * 1024 * 1024))
+BULK_IMPORT_MAX_LINE = int(os.getenv("BULK_IMPORT_MAX_LINE", 1024 * 1024))
+
+# Only the first errors and duplicates are listed in the report, all of them are counted
+MAX_REPORTED = 100
+
+class LineTooLong(Exception):
+    pass
+
+# Split a stream of byte chunks into lines without holding more than one line in memory
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+
+        if len(buffer) > BULK_IMPORT_MAX_LINE:
+            raise LineTooLong()
+
+    if buffer:
+        yield buffer
+
+async def upload_chunks(upload: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await upload.read(CHUNK_SIZE):
+        yield chunk
+
+# Zip archive of recipe images, lines reference a member by its name in the "image" field.
+# The form parser spools the whole archive to a temporary file before the first line is imported,
+# its size counts against BULK_IMPORT_MAX_BODY_SIZE like the rest of the request body.
+class ImageArchive:
+
+    def __init__(self, archive: zipfile.ZipFile):
+        self.archive = archive
+        # Members validated and written to a temporary file of the store, not stored yet: name -> (file, blob path)
+        self.staged: dict[str, tuple[Path, str]] = {}
+
+    @classmethod
+    async def open(cls, upload: UploadFile) -> "ImageArchive":
+        try:
+            return cls(await run_in_threadpool(zipfile.ZipFile, upload.file))
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="images must be a zip archive")
+
+    # Validate a member and stage it (size limited like any upload), returns its blob path
+    async def stage(self, name: str) -> str:
+        if name not in self.staged:
+            try:
+                info = self.archive.getinfo(name)
+            except KeyError:
+                raise HTTPException(status_code=400, detail="Image not found in the archive")
+
+            member = await run_in_threadpool(self.archive.open, info)
+            try:
+                self.staged[name] = await stage_image_upload(UploadFile(member, size=info.file_size, filename=name))
+            finally:
+                member.close()
+
+        return self.staged[name][1]
+
+    # Store a staged member with one reference per recipe using it, in the caller's transaction.
+    # A retried chunk stages it again.
+    async def store(self, db: AsyncSession, name: str, references: int):
+        part_path, path = self.staged.pop(name)
+        await store_staged_image(db, part_path, path, references)
+
+    # Remove the staged members that were not stored (their lines were skipped or failed)
+    def discard(self):
+        for part_path, _ in self.staged.values():
+            part_path.unlink(missing_ok=True)
+        self.staged.clear()
+
+# Imports NDJSON lines in chunks. Lines are validated against schemas.Recipe, names already in the file or
+# in the database are skipped as duplicates (one query per chunk) and each chunk is committed on its own,
+# so a failure only loses the chunk it happened in.
+class BulkImport:
+
+    def __init__(self, db: AsyncSession, owner_id: int, images: Optional[ImageArchive] = None):
+        self.db = db
+        self.owner_id = owner_id
+        self.images = images
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.duplicates = []
+        self.duplicate_count = 0
+        self.image_paths = []
+        # Names seen so far, to catch duplicates within the file without asking the database again
+        self.seen: set[str] = set()
+        self.pending: list[tuple[int, RecipeSchema, Optional[str]]] = []
+
+    def error(self, line: int, detail):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED:
+            self.errors.append({"line": line, "detail": detail})
+
+    def duplicate(self, line: int, recipe_name: str):
+        self.duplicate_count += 1
+        if len(self.duplicates) < MAX_REPORTED:
+            self.duplicates.append({"line": line, "recipe_name": recipe_name})
+
+    async def run(self, lines: AsyncIterator[bytes]) -> dict:
+        number = 0
+        try:
+            async for line in lines:
+                number += 1
+                await self.add(number, line)
+        except LineTooLong:
+            self.error(number + 1, f"Line longer than {BULK_IMPORT_MAX_LINE} bytes, the rest of the input was not imported")
+
+        await self.flush()
+
+        return {
+            "created": self.created,
+            "duplicates": self.duplicate_count,
+            "failed": self.failed,
+            "duplicate_lines": self.duplicates,
+            "errors": self.errors,
+        }
+
+    async def add(self, number: int, line: bytes):
+        if not line.strip():
+            return
+
+        try:
+            data = orjson.loads(line)
+            recipe = RecipeSchema.model_validate(data)
+        except orjson.JSONDecodeError:
+            self.error(number, "Invalid JSON")
+            return
+        except ValidationError as e:
+            self.error(number, e.errors(include_url=False, include_context=False, include_input=False))
+            return
+
+        image = data.get("image")
+        if image is not None and (not isinstance(image, str) or self.images is None):
+            self.error(number, "image must name a file of the images archive")
+            return
+
+        if recipe.recipe_name in self.seen:
+            self.duplicate(number, recipe.recipe_name)
+            return
+
+        self.seen.add(recipe.recipe_name)
+        self.pending.append((number, recipe, image))
+
+        if len(self.pending) >= BULK_IMPORT_CHUNK_SIZE:
+            await self.flush()
+
+    # Recipes of a chunk whose name isn't in the database yet
+    async def new_records(self, records: list) -> list:
+        names = [recipe.recipe_name for _, recipe, _ in records]
+        existing = set((await self.db.scalars(select(Recipe.recipe_name).where(Recipe.recipe_name.in_(names)))).all())
+
+        for number, recipe, _ in records:
+            if recipe.recipe_name in existing:
+                self.duplicate(number, recipe.recipe_name)
+
+        return [record for record in records if record[1].recipe_name not in existing]
+
+    # Stage the images of a chunk before its transaction, an invalid one only drops its own line
+    async def stage_images(self, records: list) -> list:
+        staged = []
+        for number, recipe, image in records:
+            if image:
+                try:
+                    await self.images.stage(image)
+                except HTTPException as e:
+                    self.error(number, f"{image}: {e.detail}")
+                    continue
+            staged.append((number, recipe, image))
+
+        return staged
+
+    async def flush(self):
+        records, self.pending = self.pending, []
+        if not records:
+            return
+
+        try:
+            records = await self.stage_images(await self.new_records(records))
+            try:
+                image_paths = await self.insert(records)
+            except IntegrityError:
+                # Another request created some of the names since the check, check again and retry once.
+                # Blobs stored by the failed attempt are removed before the rollback releases their rows.
+                await run_rollback_callbacks(self.db)
+                await self.db.rollback()
+                records = await self.stage_images(await self.new_records(records))
+                try:
+                    image_paths = await self.insert(records)
+                except IntegrityError:
+                    await run_rollback_callbacks(self.db)
+                    await self.db.rollback()
+                    for number, _, _ in records:
+                        self.error(number, "Chunk could not be inserted")
+                    return
+        finally:
+            if self.images is not None:
+                self.images.discard()
+
+        self.created += len(records)
+        self.image_paths.extend(image_paths)
+
+    # Insert a chunk and its images in one transaction, returns the blob paths of the images
+    async def insert(self, records: list) -> list[str]:
+        if not records:
+            return []
+
+        # In blob path order, so concurrent imports lock the rows in the same order
+        references = Counter(image for _, _, image in records if image)
+        image_paths = {name: self.images.staged[name][1] for name in references}
+        for name in sorted(references, key=image_paths.get):
+            await self.images.store(self.db, name, references[name])
+
+        # Core style bulk inserts, the ids come back in the order of the rows
+        recipe_ids = (await self.db.scalars(
+            insert(Recipe).returning(Recipe.id, sort_by_parameter_order=True),
+            [
+                {
+                    "recipe_name": recipe.recipe_name, "preperation_time": recipe.preperation_time,
+                    "dish_type": recipe.dish_type, "dish_type_key": lookup_key(recipe.dish_type),
+                    "calories": recipe.calories, "owner_id": self.owner_id,
+                    "image_url": f"/{image_paths[image]}" if image else None,
+                }
+                for _, recipe, image in records
+            ]
+        )).all()
+
+        ingredient_rows, index_rows, documents = [], [], []
+        for recipe_id, (_, recipe, _) in zip(recipe_ids, records):
+            tokens = set()
+            for position, text in enumerate(recipe.recipe_ingredients):
+                ingredient_rows.append({"recipe_id": recipe_id, "position": position, **parse_ingredient(text)})
+                tokens |= tokenize(text)
+            index_rows.extend({"token": token, "recipe_id": recipe_id} for token in tokens)
+            documents.append(document(recipe_id, recipe.recipe_name, recipe.dish_type, recipe.recipe_ingredients))
+
+        await self.db.execute(insert(RecipeIngredient), ingredient_rows)
+        if index_rows:
+            await self.db.execute(insert(IngredientIndex), index_rows)
+        await index_recipes(self.db, documents)
+        await self.db.commit()
+
+        return list(image_paths.values())
@@ -1,143 +1,109 @@
-from fastapi_mail import FastMail, MessageSchema
-from config import mail_conf, FRONTEND_URL
-
-fm = FastMail(mail_conf)
-
-async def send_verification_email(to_email: str, token: str):
-    
-    verification_link = f"{FRONTEND_URL}/verify-email?token={token}" 
-
-    message = MessageSchema(
-        subject = "Verify your email",
-        recipients = [to_email],
-        body = f"""
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <title>Verify your email</title>
-</head>
-<body style="margin:0; padding:0; background-color:#f4f4f4; font-family: Arial, sans-serif;">
-  <table width="100%" cellpadding="0" cellspacing="0">
-    <tr>
-      <td align="center" style="padding:40px 0;">
-        <table width="600" cellpadding="0" cellspacing="0" style="background:#ffffff; border-radius:8px; padding:30px;">
-          
-          <tr>
-            <td style="text-align:center;">
-              <h2 style="color:#222;">Verify your email address</h2>
-            </td>
-          </tr>
-
-          <tr>
-            <td style="padding:20px 0; color:#555; font-size:15px;">
-              Hi,<br><br>
-              Thank you for signing up!  
-              Please confirm your email address by clicking the button below.
-            </td>
-          </tr>
-
-          <tr>
-            <td align="center" style="padding:20px 0;">
-              <a href="{verification_link}"
-                 style="background:#FF8C42; color:#ffffff; text-decoration:none;
-                        padding:12px 24px; border-radius:6px; font-weight:bold;">
-                Verify Email
-              </a>
-            </td>
-          </tr>
-
-          <tr>
-            <td style="padding-top:20px; color:#777; font-size:14px;">
-              This link will expire in <strong>30 minutes</strong>.<br><br>
-              If you did not create this account, you can safely ignore this email.
-            </td>
-          </tr>
-
-          <tr>
-            <td style="padding-top:30px; color:#999; font-size:13px; text-align:center;">
-              © Your App · All rights reserved
-            </td>
-          </tr>
-
-        </table>
-      </td>
-    </tr>
-  </table>
-</body>
-</html>
-""",
-        subtype = "html"
-    )
-
-    await fm.send_message(message)
-
-
-async def send_reset_password_email(to_email: str, token: str):
-
-    password_reset_link = f"{FRONTEND_URL}/reset-password?token={token}" 
-
-    message = MessageSchema(
-        subject = "Reset your password",
-        recipients = [to_email],
-        body = f"""
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <title>Reset your password</title>
-</head>
-<body style="margin:0; padding:0; background-color:#f4f4f4; font-family: Arial, sans-serif;">
-  <table width="100%" cellpadding="0" cellspacing="0">
-    <tr>
-      <td align="center" style="padding:40px 0;">
-        <table width="600" cellpadding="0" cellspacing="0" style="background:#ffffff; border-radius:8px; padding:30px;">
-          
-          <tr>
-            <td style="text-align:center;">
-              <h2 style="color:#222;">Reset your password</h2>
-            </td>
-          </tr>
-
-          <tr>
-            <td style="padding:20px 0; color:#555; font-size:15px;">
-              Hi,<br><br>
-              We received a request to reset your password.
-              Click the button below to create a new one.
-            </td>
-          </tr>
-
-          <tr>
-            <td align="center" style="padding:20px 0;">
-              <a href="{password_reset_link}"
-                 style="background:#FF8C42; color:#ffffff; text-decoration:none;
-                        padding:12px 24px; border-radius:6px; font-weight:bold;">
-                Reset Password
-              </a>
-            </td>
-          </tr>
-
-          <tr>
-            <td style="padding-top:20px; color:#777; font-size:14px;">
-              This link will expire in <strong>30 minutes</strong>.<br><br>
-              If you did not request a password reset, you can safely ignore this email.
-            </td>
-          </tr>
-
-          <tr>
-            <td style="padding-top:30px; color:#999; font-size:13px; text-align:center;">
-              © Your App · All rights reserved
-            </td>
-          </tr>
-
-        </table>
-      </td>
-    </tr>
-  </table>
-</body>
-</html>
-""",
-        subtype="html"
-    )
-
-    await fm.send_message(message)
\ No newline at end of file
+from config import FRONTEND_URL
+from services.mail_queue import enqueue_email, enqueue_emails
+from functools import cache
+from pathlib import Path
+import gettext
+import json
+import os
+
+# Emails are rendered from templates/email and queued for the mail worker, these calls return immediately
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates" / "email"
+LOCALES_DIR = TEMPLATES_DIR / "locales"
+DEFAULT_LOCALE = os.getenv("EMAIL_DEFAULT_LOCALE", "en")
+LINK_EXPIRE_MINUTES = 30
+
+EMAIL_SUBJECTS = {
+    "verify_email": "Verify your email",
+    "reset_password": "Reset your password",
+}
+
+# Translations from a JSON catalog (English message -> translated message), missing messages stay in English
+class CatalogTranslations(gettext.NullTranslations):
+
+    def __init__(self, messages: dict[str, str]):
+        super().__init__()
+        self.messages = messages
+
+    def gettext(self, message):
+        return self.messages.get(message, message)
+
+    def ngettext(self, singular, plural, n):
+        message = singular if n == 1 else plural
+        return self.messages.get(message, message)
+
+def _load_catalogs() -> dict[str, CatalogTranslations]:
+    catalogs = {DEFAULT_LOCALE: CatalogTranslations({})}
+    for path in sorted(LOCALES_DIR.glob("*.json")):
+        catalogs[path.stem] = CatalogTranslations(json.loads(path.read_text(encoding="utf-8")))
+
+    return catalogs
+
+# One environment per locale, all sharing the loader and the compiled bytecode cache.
+# Every template is compiled once, by the application lifespan at startup (or on the first email
+# outside the application), rendering only runs the compiled code.
+@cache
+def get_templates() -> dict[str, dict[str, tuple]]:
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+
+    loader = FileSystemLoader(TEMPLATES_DIR)
+    bytecode_cache = FileSystemBytecodeCache(os.getenv("EMAIL_TEMPLATE_CACHE_DIR"))
+    compiled = {}
+
+    for locale, translations in _load_catalogs().items():
+        env = Environment(
+            loader=loader,
+            bytecode_cache=bytecode_cache,
+            autoescape=select_autoescape(["html"]),
+            extensions=["jinja2.ext.i18n"],
+        )
+        env.install_gettext_translations(translations, newstyle=True)
+
+        compiled[locale] = {
+            name: (translations.gettext(subject), env.get_template(f"{name}.html"), env.get_template(f"{name}.txt"))
+            for name, subject in EMAIL_SUBJECTS.items()
+        }
+
+    return compiled
+
+# Pick the first supported locale from an Accept-Language header
+def preferred_locale(accept_language: str | None) -> str:
+    for part in (accept_language or "").split(","):
+        language = part.split(";")[0].strip().lower()
+        for locale in (language, language.split("-")[0]):
+            if locale in get_templates():
+                return locale
+
+    return DEFAULT_LOCALE
+
+# Render (subject, html, text) of an email
+def render_email(name: str, locale: str = DEFAULT_LOCALE, **context) -> tuple[str, str, str]:
+    templates = get_templates()
+    subject, html_template, text_template = templates.get(locale, templates[DEFAULT_LOCALE])[name]
+    context.setdefault("expires_minutes", LINK_EXPIRE_MINUTES)
+
+    return subject, html_template.render(context), text_template.render(context)
+
+# Render one email per recipient and queue them all in a single round trip (bulk notifications)
+async def send_bulk_email(name: str, recipients: list[tuple[str, dict]], locale: str = DEFAULT_LOCALE):
+    jobs = []
+    for to_email, context in recipients:
+        subject, html, text = render_email(name, locale, **context)
+        jobs.append((to_email, subject, html, text))
+
+    await enqueue_emails(jobs)
+
+async def send_verification_email(to_email: str, token: str, locale: str = DEFAULT_LOCALE):
+
+    verification_link = f"{FRONTEND_URL}/verify-email?token={token}"
+    subject, html, text = render_email("verify_email", locale, link=verification_link)
+
+    await enqueue_email(to_email, subject, html, text)
+
+
+async def send_reset_password_email(to_email: str, token: str, locale: str = DEFAULT_LOCALE):
+
+    password_reset_link = f"{FRONTEND_URL}/reset-password?token={token}"
+    subject, html, text = render_email("reset_password", locale, link=password_reset_link)
+
+    await enqueue_email(to_email, subject, html, text)
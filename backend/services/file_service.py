@@ -1,30 +1,78 @@
 from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+import hashlib
 import secrets
 import os
-import shutil
 from fastapi import UploadFile, HTTPException
 
-UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads/profiles"))
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+# Content-addressed store: every image is saved once as {sha256}.{ext}, sharded by the first hash bytes
+IMAGE_STORE_DIR = Path(os.getenv("IMAGE_STORE_DIR", "images/blobs"))
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 5 * 1024 * 1024))  # 5MB
+CHUNK_SIZE = 64 * 1024
 
+# Magic bytes of the accepted image formats and their file extension
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
 
-def save_profile_image(profile_image: UploadFile) -> str:
-    ext = profile_image.filename.rsplit(".", 1)[-1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail="Invalid file type")
+# Detect the image type from the first bytes of the file
+def detect_image_type(head: bytes):
+    for signature, ext in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return ext
 
-    profile_image.file.seek(0, 2)
-    file_size = profile_image.file.tell()
-    profile_image.file.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
 
-    if file_size > MAX_FILE_SIZE:
+    return None
+
+# Stream an uploaded image into a temporary file of the store in chunks, hashing it on the way.
+# The type is validated from the first chunk and the upload is aborted as soon as it exceeds max_size,
+# so memory use per request stays bounded by CHUNK_SIZE.
+# Returns the temporary file and the blob path it belongs at (identical images always map to the same path),
+# place_image() moves it there.
+async def stage_image_upload(upload: UploadFile, max_size: int = MAX_FILE_SIZE) -> tuple[Path, str]:
+
+    if upload.size is not None and upload.size > max_size:
         raise HTTPException(status_code=400, detail="File too large")
 
-    filename = f"user_{secrets.token_hex(8)}.{ext}"
-    file_path = UPLOAD_DIR / filename
+    first_chunk = await upload.read(CHUNK_SIZE)
+    ext = detect_image_type(first_chunk)
+    if not ext:
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    IMAGE_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    part_path = IMAGE_STORE_DIR / f".{secrets.token_hex(8)}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    chunk = first_chunk
+    f = await run_in_threadpool(part_path.open, "wb")
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status_code=400, detail="File too large")
+
+            digest.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+            chunk = await upload.read(CHUNK_SIZE)
+    except BaseException:
+        f.close()
+        part_path.unlink(missing_ok=True)
+        raise
+
+    await run_in_threadpool(f.close)
+
+    blob_hash = digest.hexdigest()
+    file_path = IMAGE_STORE_DIR / blob_hash[:2] / blob_hash[2:4] / f"{blob_hash}.{ext}"
 
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(profile_image.file, buffer)
+    return part_path, file_path.as_posix()
 
-    return f"uploads/profiles/{filename}"
\ No newline at end of file
+# Move a staged upload to its blob path
+def place_image(part_path: Path, path: str):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    part_path.replace(path)
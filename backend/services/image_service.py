@@ -0,0 +1,98 @@
+from fastapi.staticfiles import StaticFiles
+from functools import cache
+from pathlib import Path
+import logging
+import os
+import secrets
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 320))
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", 7 * 24 * 3600))
+
+# Derivative name -> (file suffix, Pillow format, max size or None to keep the original size)
+VARIANTS = {
+    "thumbnail": ("_thumb.webp", "WEBP", THUMBNAIL_SIZE),
+    "webp": ("_full.webp", "WEBP", None),
+    "avif": ("_full.avif", "AVIF", None),
+}
+
+# Pillow is imported lazily, it is only needed by the background generator
+@cache
+def enabled_variants() -> tuple[str, ...]:
+    from PIL import features
+
+    return tuple(name for name in VARIANTS if name != "avif" or features.check("avif"))
+
+def _variant_path(path: str, name: str) -> str:
+    return os.path.splitext(path)[0] + VARIANTS[name][0]
+
+# URLs of the derivatives of an image URL (or path), keyed by variant name.
+# Derivatives are written by a background task after the upload, images older than them only get some from
+# `python manage.py derivatives`. A derivative that doesn't exist on disk (not generated yet, or generation failed)
+# is replaced by the original image URL, so every listed URL can be loaded.
+def variant_urls(image_url: str | None) -> dict[str, str]:
+    if not image_url:
+        return {}
+
+    variants = {}
+    for name in enabled_variants():
+        variant_url = _variant_path(image_url, name)
+        variants[name] = variant_url if os.path.exists(variant_url.lstrip("/")) else image_url
+
+    return variants
+
+# Generate resized and re-encoded derivatives of a saved image.
+# Runs as a background task after the response was sent, failures are only logged.
+# Derivatives that already exist (a deduplicated re-upload) are not generated again.
+def generate_derivatives(path: str | Path):
+    from PIL import Image, ImageOps
+
+    path = str(path)
+    if all(os.path.exists(_variant_path(path, name)) for name in enabled_variants()):
+        return
+
+    try:
+        with Image.open(path) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+            for name in enabled_variants():
+                _, image_format, max_size = VARIANTS[name]
+                variant = image.copy()
+                if max_size:
+                    variant.thumbnail((max_size, max_size))
+
+                # Identical uploads share one blob, so the same variant can be generated concurrently
+                target = _variant_path(path, name)
+                part = f"{target}.{secrets.token_hex(4)}.part"
+                variant.save(part, format=image_format, quality=80)
+                os.replace(part, target)
+    except Exception:
+        logger.exception("Failed to generate image derivatives for %s", path)
+
+# Remove an image together with its derivatives
+def delete_image_files(path: str | Path):
+    path = str(path)
+    for file_path in [path, *(_variant_path(path, name) for name in VARIANTS)]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+# StaticFiles with a Cache-Control header, ETag/Last-Modified and 304 handling come from StaticFiles itself.
+# Content-addressed files never change, so they can be marked immutable and cached for a year.
+class CachedStaticFiles(StaticFiles):
+
+    def __init__(self, *args, immutable: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if immutable:
+            self.cache_control = "public, max-age=31536000, immutable"
+        else:
+            self.cache_control = f"public, max-age={IMAGE_CACHE_MAX_AGE}"
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = self.cache_control
+
+        return response
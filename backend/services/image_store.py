@@ -0,0 +1,115 @@
+from fastapi import UploadFile
+from sqlalchemy import select, update, delete, case
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from database import AsyncSessionLocal, DATABASE_URL, on_rollback
+from models import ImageBlob
+from services.file_service import stage_image_upload, place_image
+from services.image_service import delete_image_files
+from datetime import datetime, timedelta
+from pathlib import Path, PurePosixPath
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Unreferenced blobs are kept this long so a re-upload of the same image can reuse them
+IMAGE_GC_GRACE_SECONDS = int(os.getenv("IMAGE_GC_GRACE_SECONDS", 3600))
+IMAGE_GC_INTERVAL_SECONDS = int(os.getenv("IMAGE_GC_INTERVAL_SECONDS", 600))
+IMAGE_GC_BATCH_SIZE = 500
+
+def _blob_hash(path: str) -> str:
+    return PurePosixPath(path).stem
+
+# Add references to a blob (path as returned by stage_image_upload), returns the new reference count.
+# One upsert, so concurrent first uploads of the same image don't both try to insert its row.
+async def acquire_image(db: AsyncSession, path: str, references: int = 1) -> int:
+    path = path.lstrip("/")
+    insert = postgresql_insert if DATABASE_URL.get_backend_name() == "postgresql" else sqlite_insert
+
+    return await db.scalar(
+        insert(ImageBlob)
+        .values(hash=_blob_hash(path), path=path, ref_count=references)
+        .on_conflict_do_update(index_elements=[ImageBlob.hash], set_={"ref_count": ImageBlob.ref_count + references, "released_at": None})
+        .returning(ImageBlob.ref_count)
+    )
+
+# Store an uploaded image and add a reference to it in the caller's transaction, returns the blob path
+async def store_image(db: AsyncSession, upload: UploadFile) -> str:
+    part_path, path = await stage_image_upload(upload)
+    await store_staged_image(db, part_path, path)
+    return path
+
+# Add references to a staged image in the caller's transaction and move it to its blob path.
+# The file is only moved into place once the reference is taken: the garbage collector removes rows and files
+# while holding the row locks, so a blob being collected is written again after its files are gone, not before.
+# The file of a blob without other references is removed again if the transaction doesn't commit.
+async def store_staged_image(db: AsyncSession, part_path: Path, path: str, references: int = 1):
+    try:
+        ref_count = await acquire_image(db, path, references)
+        await run_in_threadpool(place_image, part_path, path)
+    finally:
+        part_path.unlink(missing_ok=True)
+
+    if ref_count == references:
+        on_rollback(db, lambda: run_in_threadpool(delete_image_files, path))
+
+# Drop a reference to an image URL or path.
+# Returns False for images saved before the blob store existed, the caller deletes those files itself.
+async def release_image(db: AsyncSession, path: str) -> bool:
+    path = path.lstrip("/")
+    result = await db.execute(
+        update(ImageBlob)
+        .where(ImageBlob.hash == _blob_hash(path), ImageBlob.path == path)
+        .values(
+            ref_count=ImageBlob.ref_count - 1,
+            released_at=case((ImageBlob.ref_count <= 1, datetime.utcnow()), else_=None)
+        )
+    )
+
+    return result.rowcount > 0
+
+# Delete blobs (and their derivatives) that have been unreferenced for longer than the grace period
+async def collect_garbage() -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=IMAGE_GC_GRACE_SECONDS)
+
+    async with AsyncSessionLocal() as db:
+        hashes = (await db.scalars(
+            select(ImageBlob.hash)
+            .where(ImageBlob.ref_count <= 0, ImageBlob.released_at < cutoff)
+            .limit(IMAGE_GC_BATCH_SIZE)
+        )).all()
+
+        if not hashes:
+            return 0
+
+        # The ref_count condition is checked again so blobs acquired in the meantime are kept.
+        # Files are removed before the commit: until then the deleted rows stay locked and an upload of the
+        # same image waits in acquire_image(), then writes its file again (see store_staged_image()).
+        paths = (await db.scalars(
+            delete(ImageBlob)
+            .where(ImageBlob.hash.in_(hashes), ImageBlob.ref_count <= 0)
+            .returning(ImageBlob.path)
+        )).all()
+
+        for path in paths:
+            await run_in_threadpool(delete_image_files, path)
+
+        await db.commit()
+
+    return len(paths)
+
+# Background loop started with the application
+async def run_garbage_collector():
+    while True:
+        try:
+            collected = await collect_garbage()
+            if collected:
+                logger.info("Collected %d unreferenced image blobs", collected)
+        except Exception:
+            logger.exception("Image garbage collection failed")
+
+        await asyncio.sleep(IMAGE_GC_INTERVAL_SECONDS)
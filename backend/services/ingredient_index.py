@@ -0,0 +1,51 @@
+from sqlalchemy import select, intersect, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models import IngredientIndex, Recipe
+import re
+
+# The only index of ingredient searches: every word of every ingredient of a recipe (recipe_ingredients rows
+# keep the parsed ingredients but are only read by recipe id)
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Highest code point, used as the upper bound of a prefix range scan
+PREFIX_END = "\U0010ffff"
+
+# Split ingredient text into normalized (lowercase) word tokens
+def tokenize(text: str) -> set[str]:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+# Store the posting list entries of a recipe (call after the recipe has an id)
+def index_recipe(db: AsyncSession | Session, recipe: Recipe):
+    tokens = set()
+    for ingredient in recipe.recipe_ingredients:
+        tokens |= tokenize(str(ingredient))
+
+    db.add_all(IngredientIndex(token=token, recipe_id=recipe.id) for token in tokens)
+
+# Remove the posting list entries of a recipe
+async def remove_recipe(db: AsyncSession, recipe_id: int):
+    await db.execute(delete(IngredientIndex).where(IngredientIndex.recipe_id == recipe_id))
+
+# Rebuild the posting list entries of a recipe after its ingredients changed
+async def reindex_recipe(db: AsyncSession, recipe: Recipe):
+    await remove_recipe(db, recipe.id)
+    index_recipe(db, recipe)
+
+# Build a select of recipe ids containing every searched ingredient.
+# Each query token is matched as a prefix ("tom" matches "tomatoes") with an index range scan,
+# and the posting lists of all tokens are intersected in the database.
+def matching_recipe_ids(ingredients: list[str]):
+    tokens = set()
+    for ingredient in ingredients:
+        tokens |= tokenize(str(ingredient))
+
+    if not tokens:
+        return None
+
+    postings = [
+        select(IngredientIndex.recipe_id).where(IngredientIndex.token >= token, IngredientIndex.token < token + PREFIX_END)
+        for token in sorted(tokens)
+    ]
+
+    return postings[0] if len(postings) == 1 else intersect(*postings)
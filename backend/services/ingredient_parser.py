@@ -0,0 +1,70 @@
+from fractions import Fraction
+import re
+
+# Units recognised after a leading quantity, mapped to their canonical spelling
+UNITS = {
+    "g": "g", "gram": "g", "grams": "g", "gr": "g",
+    "kg": "kg", "kilogram": "kg", "kilograms": "kg",
+    "mg": "mg",
+    "ml": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml",
+    "l": "l", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "dl": "dl", "cl": "cl",
+    "tsp": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "tbsp": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "cup": "cup", "cups": "cup",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "pinch": "pinch", "pinches": "pinch",
+    "clove": "clove", "cloves": "clove",
+    "slice": "slice", "slices": "slice",
+    "can": "can", "cans": "can",
+    "piece": "piece", "pieces": "piece", "pcs": "piece",
+}
+
+UNICODE_FRACTIONS = {"½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4", "⅛": "1/8"}
+
+# Leading quantity: "2", "1.5", "1,5", "1/2" or "1 1/2", optionally followed by a unit
+QUANTITY_PATTERN = re.compile(r"^\s*(\d+\s+\d+/\d+|\d+/\d+|\d+(?:[.,]\d+)?)\s*([^\W\d]+\.?)?\s*(.*)$")
+KEY_PATTERN = re.compile(r"\w+")
+
+def parse_quantity(value: str) -> float:
+    whole, _, fraction = value.rpartition(" ")
+    if "/" in fraction:
+        return float(int(whole or 0) + Fraction(fraction))
+    return float(value.replace(",", "."))
+
+# Normalized lookup key of a name: lowercase words joined by single spaces
+def lookup_key(name: str) -> str:
+    return " ".join(KEY_PATTERN.findall(name.lower()))
+
+# Split free-form ingredient text ("200 g flour", "1 1/2 cups milk", "salt") into typed parts.
+# The original text is kept so the API returns ingredients exactly as they were entered.
+def parse_ingredient(text: str) -> dict:
+
+    normalized = text
+    for symbol, fraction in UNICODE_FRACTIONS.items():
+        normalized = normalized.replace(symbol, f" {fraction}")
+
+    quantity = unit = None
+    name = text.strip()
+
+    match = QUANTITY_PATTERN.match(normalized)
+    if match:
+        amount, word, rest = match.groups()
+        quantity = parse_quantity(" ".join(amount.split()))
+
+        if word and word.rstrip(".").lower() in UNITS:
+            unit = UNITS[word.rstrip(".").lower()]
+            name = rest
+        else:
+            name = f"{word or ''} {rest}"
+
+        name = name.strip() or text.strip()
+
+    return {
+        "text": text,
+        "name": name,
+        "key": lookup_key(name),
+        "quantity": quantity,
+        "unit": unit,
+    }
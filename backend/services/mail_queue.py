@@ -0,0 +1,244 @@
+from email.message import EmailMessage
+from config import get_mail_conf, MAIL_BACKEND
+from redis_client import ar
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Redis keys: pending messages (list), messages waiting for a retry (sorted set by due time),
+# messages that failed MAIL_MAX_ATTEMPTS times (list) and sent/failed counters (hash).
+# Workers move the messages they are sending to their own processing list (PROCESSING_KEY + worker id)
+# and remove each one once it is handled, WORKERS_KEY holds the last heartbeat of every worker.
+QUEUE_KEY = "mail:queue"
+RETRY_KEY = "mail:retry"
+DEAD_KEY = "mail:dead"
+STATS_KEY = "mail:stats"
+PROCESSING_KEY = "mail:processing:"
+WORKERS_KEY = "mail:workers"
+
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 5))
+MAIL_RETRY_BASE_SECONDS = int(os.getenv("MAIL_RETRY_BASE_SECONDS", 30))
+
+# The pooled SMTP connection is closed after being idle this long
+SMTP_IDLE_TIMEOUT = int(os.getenv("SMTP_IDLE_TIMEOUT", 30))
+POLL_SECONDS = 5
+# A worker without a heartbeat for this long is considered dead, its processing list is put back on the queue
+MAIL_WORKER_TIMEOUT = int(os.getenv("MAIL_WORKER_TIMEOUT", 120))
+# Retries moved back onto the queue per script call, bounds the time Redis spends in one call
+REQUEUE_BATCH_SIZE = 1000
+
+# KEYS: retry sorted set, queue. ARGV: current time, batch size.
+# Moves the retries that are due to the queue in one atomic step, a message is never in neither of them.
+REQUEUE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('RPUSH', KEYS[2], job)
+end
+return #due
+"""
+
+requeue_due_script = ar.register_script(REQUEUE_DUE_SCRIPT)
+
+def _job(to_email: str, subject: str, html: str, text: str | None = None) -> str:
+    return json.dumps({"to": to_email, "subject": subject, "html": html, "text": text, "attempts": 0})
+
+# Put a message on the outbound queue, the request doesn't wait for SMTP
+async def enqueue_email(to_email: str, subject: str, html: str, text: str | None = None):
+    await ar.rpush(QUEUE_KEY, _job(to_email, subject, html, text))
+
+# Queue many (to_email, subject, html, text) messages with one command
+async def enqueue_emails(messages: list[tuple]):
+    if messages:
+        await ar.rpush(QUEUE_KEY, *(_job(*message) for message in messages))
+
+def _build_message(job: dict) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = get_mail_conf().MAIL_FROM
+    message["To"] = job["to"]
+    message["Subject"] = job["subject"]
+
+    if job.get("text"):
+        message.set_content(job["text"])
+        message.add_alternative(job["html"], subtype="html")
+    else:
+        message.set_content(job["html"], subtype="html")
+
+    return message
+
+# One long lived SMTP connection, reused for every message until it is idle or fails
+class SmtpConnection:
+
+    def __init__(self):
+        self.client = None
+        self.last_used = 0.0
+
+    async def send(self, message: EmailMessage):
+        if MAIL_BACKEND == "console":
+            logger.info("Email to %s:\n%s", message["To"], message)
+            return
+
+        if self.client is None:
+            # Imported on first use, like the mail configuration, the SMTP stack isn't needed to serve requests
+            import aiosmtplib
+
+            mail_conf = get_mail_conf()
+            self.client = aiosmtplib.SMTP(
+                hostname=mail_conf.MAIL_SERVER,
+                port=mail_conf.MAIL_PORT,
+                use_tls=mail_conf.MAIL_SSL_TLS,
+                start_tls=mail_conf.MAIL_STARTTLS,
+            )
+            await self.client.connect()
+            if mail_conf.USE_CREDENTIALS:
+                await self.client.login(mail_conf.MAIL_USERNAME, mail_conf.MAIL_PASSWORD.get_secret_value())
+
+        await self.client.send_message(message)
+        self.last_used = time.monotonic()
+
+    async def close(self):
+        if self.client is not None:
+            from aiosmtplib import SMTPException
+
+            try:
+                await self.client.quit()
+            except SMTPException:
+                pass
+            self.client = None
+
+    async def close_if_idle(self):
+        if self.client is not None and time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT:
+            await self.close()
+
+# Failed messages are retried with exponential backoff, then moved to the dead letter list.
+# Queued on the pipeline that acknowledges the message.
+def _retry_later(pipe, job: dict):
+    job["attempts"] += 1
+    pipe.hincrby(STATS_KEY, "failed", 1)
+
+    if job["attempts"] >= MAIL_MAX_ATTEMPTS:
+        pipe.rpush(DEAD_KEY, json.dumps(job))
+        return
+
+    due = time.time() + MAIL_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+    pipe.zadd(RETRY_KEY, {json.dumps(job): due})
+
+# Move retries that are due back onto the queue
+async def _requeue_due():
+    while await requeue_due_script(keys=[RETRY_KEY, QUEUE_KEY], args=[time.time(), REQUEUE_BATCH_SIZE]) == REQUEUE_BATCH_SIZE:
+        pass
+
+# Put the messages of a processing list back at the head of the queue, in their original order
+async def _requeue_processing(worker_id: str):
+    while await ar.lmove(PROCESSING_KEY + worker_id, QUEUE_KEY, "RIGHT", "LEFT") is not None:
+        pass
+
+# Requeue the messages of workers that stopped without finishing them (crashed or killed)
+async def _recover_dead_workers():
+    cutoff = time.time() - MAIL_WORKER_TIMEOUT
+    for worker_id, last_seen in (await ar.hgetall(WORKERS_KEY)).items():
+        if float(last_seen) < cutoff:
+            await _requeue_processing(worker_id)
+            await ar.hdel(WORKERS_KEY, worker_id)
+
+# Move up to MAIL_BATCH_SIZE messages to the processing list, waiting up to POLL_SECONDS for the first one
+async def _take_batch(processing: str) -> list[str]:
+    first = await ar.blmove(QUEUE_KEY, processing, POLL_SECONDS, "LEFT", "RIGHT")
+    if first is None:
+        return []
+
+    async with ar.pipeline(transaction=False) as pipe:
+        for _ in range(MAIL_BATCH_SIZE - 1):
+            pipe.lmove(QUEUE_KEY, processing, "LEFT", "RIGHT")
+        rest = await pipe.execute()
+
+    return [first] + [raw for raw in rest if raw is not None]
+
+# Each message is removed from the processing list once it was sent, scheduled for a retry or dead lettered,
+# so a worker stopping halfway through a batch loses none of it
+async def _send_batch(smtp: SmtpConnection, worker_id: str, batch: list[str]):
+    processing = PROCESSING_KEY + worker_id
+
+    for raw in batch:
+        async with ar.pipeline(transaction=True) as pipe:
+            try:
+                job = json.loads(raw)
+                message = _build_message(job)
+            except (ValueError, KeyError, TypeError):
+                logger.exception("Invalid mail job, moved to the dead letter list")
+                pipe.hincrby(STATS_KEY, "failed", 1)
+                pipe.rpush(DEAD_KEY, raw)
+            else:
+                try:
+                    await smtp.send(message)
+                    pipe.hincrby(STATS_KEY, "sent", 1)
+                except Exception:
+                    logger.exception("Failed to send email to %s", job["to"])
+                    await smtp.close()
+                    _retry_later(pipe, job)
+
+            pipe.lrem(processing, 1, raw)
+            pipe.hset(WORKERS_KEY, worker_id, time.time())
+            await pipe.execute()
+
+# Background worker started with the application, drains the queue in batches over one SMTP connection.
+# Messages left in its processing list are put back on the queue when it stops, or by another worker
+# once its heartbeat is older than MAIL_WORKER_TIMEOUT if it died.
+async def run_mail_worker():
+    smtp = SmtpConnection()
+    worker_id = uuid.uuid4().hex
+    failed = False
+    try:
+        while True:
+            # asyncio.wait_for() in the Redis client can swallow a cancellation (Python 3.11), the request still stands
+            if asyncio.current_task().cancelling():
+                raise asyncio.CancelledError()
+
+            try:
+                await ar.hset(WORKERS_KEY, worker_id, time.time())
+                # Messages of a batch interrupted by an error are sent again
+                if failed:
+                    await _requeue_processing(worker_id)
+                    failed = False
+
+                await _recover_dead_workers()
+                await _requeue_due()
+
+                batch = await _take_batch(PROCESSING_KEY + worker_id)
+                if not batch:
+                    await smtp.close_if_idle()
+                    continue
+
+                await _send_batch(smtp, worker_id, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Mail worker error")
+                failed = True
+                await asyncio.sleep(POLL_SECONDS)
+    finally:
+        await _requeue_processing(worker_id)
+        await ar.hdel(WORKERS_KEY, worker_id)
+        await smtp.close()
+
+async def get_mail_queue_stats() -> dict:
+    stats = await ar.hgetall(STATS_KEY)
+
+    sending = 0
+    for worker_id in await ar.hkeys(WORKERS_KEY):
+        sending += await ar.llen(PROCESSING_KEY + worker_id)
+
+    return {
+        "queued": await ar.llen(QUEUE_KEY),
+        "sending": sending,
+        "retrying": await ar.zcard(RETRY_KEY),
+        "dead": await ar.llen(DEAD_KEY),
+        "sent": int(stats.get("sent", 0)),
+        "failed": int(stats.get("failed", 0)),
+    }
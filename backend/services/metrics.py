@@ -0,0 +1,265 @@
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+import bisect
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Per request Server-Timing headers, and the N+1 query check that counts identical statements per request
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+METRICS_DEBUG = os.getenv("METRICS_DEBUG", "false").lower() == "true"
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Commands that wait server side for data, their duration says nothing about Redis latency
+BLOCKING_REDIS_COMMANDS = {"BLPOP", "BRPOP", "BLMOVE", "BRPOPLPUSH", "BZPOPMIN", "BZPOPMAX", "XREAD", "XREADGROUP"}
+
+# Metric families in the Prometheus text format. Values are per process, Prometheus scrapes (and sums) each worker.
+class Histogram:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...], buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    # series value: [count per bucket (last one is +Inf), sum]
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self.series.items()]
+
+        for label_values, counts, total in sorted(series):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, le=bound)} {cumulative}')
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+class CounterMetric:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.series[label_values] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+
+        with self.lock:
+            series = sorted(self.series.items())
+
+        lines.extend(f"{self.name}{_labels(self.labels, label_values)} {value}" for label_values, value in series)
+        return lines
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple[str, ...], values: tuple, **extra) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time until the response body was sent", ("method", "route", "status"))
+REQUEST_SQL_QUERIES = Histogram("http_request_db_queries", "SQL statements executed per request", ("method", "route"), COUNT_BUCKETS)
+REQUEST_SQL_DURATION = Histogram("http_request_db_duration_seconds", "Time spent in SQL statements per request", ("method", "route"))
+REQUEST_REDIS_COMMANDS = Histogram("http_request_redis_commands", "Redis commands sent per request", ("method", "route"), COUNT_BUCKETS)
+SQL_DURATION = Histogram("db_query_duration_seconds", "Duration of single SQL statements", ("engine", "operation"))
+REDIS_DURATION = Histogram("redis_command_duration_seconds", "Duration of single Redis commands and pipelines", ("command",))
+REDIS_COMMANDS = CounterMetric("redis_commands_total", "Redis commands sent, pipelined commands counted one by one", ("command",))
+PASSWORD_HASH_DURATION = Histogram("password_hash_duration_seconds", "bcrypt hash and verify time, including time queued for a worker", ("operation",))
+N_PLUS_ONE_WARNINGS = CounterMetric("db_n_plus_one_warnings_total", "Requests that repeated one SQL statement N_PLUS_ONE_THRESHOLD times or more (METRICS_DEBUG only)", ("route",))
+
+METRICS = [
+    REQUEST_DURATION, REQUEST_SQL_QUERIES, REQUEST_SQL_DURATION, REQUEST_REDIS_COMMANDS,
+    SQL_DURATION, REDIS_DURATION, REDIS_COMMANDS, PASSWORD_HASH_DURATION, N_PLUS_ONE_WARNINGS,
+]
+
+# Work done on behalf of the current request, collected by MetricsMiddleware.
+# Code running outside a request (background jobs, scripts) only feeds the global metrics.
+class RequestMetrics:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.redis_count = 0
+        self.redis_seconds = 0.0
+        self.password_hash_seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def server_timing(self) -> str:
+        parts = [f"app;dur={(time.perf_counter() - self.start) * 1000:.1f}"]
+        if self.sql_count:
+            parts.append(f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"')
+        if self.redis_count:
+            parts.append(f'redis;dur={self.redis_seconds * 1000:.1f};desc="{self.redis_count} commands"')
+        if self.password_hash_seconds:
+            parts.append(f"bcrypt;dur={self.password_hash_seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+def record_sql(engine_name: str, statement: str, seconds: float):
+    SQL_DURATION.observe(seconds, engine_name, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.sql_count += 1
+        metrics.sql_seconds += seconds
+        if METRICS_DEBUG:
+            metrics.statements[statement] += 1
+
+def record_redis(command: str, seconds: float, commands: int = 1):
+    REDIS_COMMANDS.inc(command, amount=commands)
+    if command not in BLOCKING_REDIS_COMMANDS:
+        REDIS_DURATION.observe(seconds, command)
+
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.redis_count += commands
+        metrics.redis_seconds += seconds
+
+def record_password_hash(operation: str, seconds: float):
+    PASSWORD_HASH_DURATION.observe(seconds, operation)
+
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.password_hash_seconds += seconds
+
+# Called by MetricsMiddleware once the response was sent
+def record_request(metrics: RequestMetrics, method: str, route: str, status: int):
+    REQUEST_DURATION.observe(time.perf_counter() - metrics.start, method, route, str(status))
+    REQUEST_SQL_QUERIES.observe(metrics.sql_count, method, route)
+    REQUEST_SQL_DURATION.observe(metrics.sql_seconds, method, route)
+    REQUEST_REDIS_COMMANDS.observe(metrics.redis_count, method, route)
+
+    # SQLAlchemy caches compiled statements, so a query run once per row has the same text each time
+    repeated = [(count, statement) for statement, count in metrics.statements.items() if count >= N_PLUS_ONE_THRESHOLD]
+    if repeated:
+        N_PLUS_ONE_WARNINGS.inc(route)
+        for count, statement in repeated:
+            logger.warning("Possible N+1 query in %s %s, statement ran %d times: %s", method, route, count, " ".join(statement.split())[:300])
+
+# Count and time the commands of a Redis client (sync or asyncio). Patched on the instance,
+# Lua scripts go through execute_command too, pipelines are timed as one round trip.
+def instrument_redis(client):
+
+    def command_name(args) -> str:
+        return str(args[0]).upper() if args else ""
+
+    def instrument_pipeline(pipe):
+        execute = pipe.execute
+
+        if _is_coroutine(execute):
+            @functools.wraps(execute)
+            async def timed_execute(*args, **kwargs):
+                commands = len(pipe.command_stack)
+                start = time.perf_counter()
+                try:
+                    return await execute(*args, **kwargs)
+                finally:
+                    record_redis("PIPELINE", time.perf_counter() - start, commands)
+        else:
+            @functools.wraps(execute)
+            def timed_execute(*args, **kwargs):
+                commands = len(pipe.command_stack)
+                start = time.perf_counter()
+                try:
+                    return execute(*args, **kwargs)
+                finally:
+                    record_redis("PIPELINE", time.perf_counter() - start, commands)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    if _is_coroutine(execute_command):
+        @functools.wraps(execute_command)
+        async def timed_execute_command(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await execute_command(*args, **kwargs)
+            finally:
+                record_redis(command_name(args), time.perf_counter() - start)
+    else:
+        @functools.wraps(execute_command)
+        def timed_execute_command(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return execute_command(*args, **kwargs)
+            finally:
+                record_redis(command_name(args), time.perf_counter() - start)
+
+    @functools.wraps(pipeline)
+    def instrumented_pipeline(*args, **kwargs):
+        return instrument_pipeline(pipeline(*args, **kwargs))
+
+    client.execute_command = timed_execute_command
+    client.pipeline = instrumented_pipeline
+    return client
+
+def _is_coroutine(func) -> bool:
+    return inspect.iscoroutinefunction(func)
+
+# Process wide gauges that are read when scraped rather than updated on every event
+def _pool_gauges() -> list[str]:
+    from database import get_pool_stats
+
+    gauges = {
+        "checked_out": ("db_pool_checked_out", "gauge", "Connections currently checked out"),
+        "size": ("db_pool_size", "gauge", "Configured pool size"),
+        "overflow": ("db_pool_overflow", "gauge", "Connections opened beyond the pool size"),
+        "checkouts": ("db_pool_checkouts_total", "counter", "Connection checkouts"),
+        "connects": ("db_pool_connects_total", "counter", "Database connections opened by the pool"),
+        "waits": ("db_pool_waits_total", "counter", "Checkouts timed from engine.connect()"),
+        "wait_seconds_total": ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection"),
+    }
+
+    stats = get_pool_stats()
+    lines = []
+    for key, (name, kind, description) in gauges.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{engine="{engine_name}"}} {values[key]}' for engine_name, values in stats.items() if values.get(key) is not None]
+
+    return lines
+
+# Prometheus text exposition of every metric
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _pool_gauges()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,34 @@
+from fastapi import HTTPException
+import base64
+import json
+
+# Encode the last seen sort key into an opaque cursor, with its relevance score for ranked results
+def encode_cursor(last_id: int, score: float = None) -> str:
+    key = {"id": last_id} if score is None else {"score": score, "id": last_id}
+    payload = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def _decode(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not isinstance(key, dict) or not isinstance(key.get("id"), int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return key
+
+# Decode an opaque cursor back into the last seen sort key
+def decode_cursor(cursor: str) -> int:
+    return _decode(cursor)["id"]
+
+# Decode the cursor of ranked results into (score, id)
+def decode_ranked_cursor(cursor: str) -> tuple[float, int]:
+    key = _decode(cursor)
+
+    if not isinstance(key.get("score"), (int, float)) or isinstance(key["score"], bool):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return float(key["score"]), key["id"]
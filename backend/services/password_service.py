@@ -0,0 +1,70 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from services.metrics import record_password_hash
+from typing import Optional
+import asyncio
+import os
+import time
+
+# Cost parameters, changing BCRYPT_ROUNDS makes existing hashes get rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+# Worker pool: "thread" (bcrypt releases the GIL) or "process"
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+
+# Max number of hash/verify jobs queued or running per worker process before returning 429
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor: Optional[Executor] = None
+_pending = 0
+
+def _get_executor() -> Executor:
+    global _executor
+
+    if _executor is None:
+        if PASSWORD_HASH_POOL == "process":
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+    return _executor
+
+# Run a CPU heavy passlib call in the pool, rejecting the request when the queue is full
+async def _run(operation: str, func, *args):
+    global _pending
+
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(status_code=429, detail="Server is busy, please try again", headers={"Retry-After": "1"})
+
+    _pending += 1
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _pending -= 1
+        record_password_hash(operation, time.perf_counter() - start)
+
+# Module level functions so they can be pickled for the process pool
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, password_hash: str):
+    return pwd_context.verify_and_update(password, password_hash)
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", _hash, password)
+
+# Returns (valid, new_hash), new_hash is set when the stored hash uses outdated cost parameters
+async def verify_password(password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+    return await _run("verify", _verify_and_update, password, password_hash)
+
+def shutdown_password_pool():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,130 @@
+from redis.exceptions import RedisError
+from redis_client import ar
+from typing import Optional
+import hashlib
+import json
+import os
+
+RECIPE_CACHE_TTL = int(os.getenv("RECIPE_CACHE_TTL", 300))
+RECIPE_PAGE_CACHE_TTL = int(os.getenv("RECIPE_PAGE_CACHE_TTL", 60))
+
+STATS_KEY = "recipes:cache:stats"
+GENERATION_KEY = "recipes:cache:generation"
+PAGE_KEY_PREFIX = "recipes:cache:pages:"
+# Per recipe version counters outlive any read that could still be holding an old version
+RECIPE_VERSION_TTL = 24 * 3600
+
+# The cache is an optimization only: when Redis is unavailable every call falls back to the database
+
+# KEYS: stats hash, recipe key, recipe version counter.
+# GET of the recipe, its version and the hit/miss count in one round trip. Returns {version, body}, body is nil on a miss.
+GET_RECIPE_SCRIPT = """
+local cached = redis.call('GET', KEYS[2])
+redis.call('HINCRBY', KEYS[1], cached and 'hits' or 'misses', 1)
+return {redis.call('GET', KEYS[3]) or '0', cached}
+"""
+
+# KEYS: recipe key, recipe version counter. ARGV: version read before loading the recipe, body, TTL.
+# The body is only stored if the recipe wasn't invalidated since that version was read.
+CACHE_RECIPE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+"""
+
+# KEYS: stats hash, generation counter. ARGV: page key prefix, page key suffix (kind and parameter fingerprint).
+# Reads the generation, the page stored under it and counts the hit/miss in one round trip.
+# Returns {page key, body, next_cursor}, body is nil on a miss.
+GET_PAGE_SCRIPT = """
+local key = ARGV[1] .. (redis.call('GET', KEYS[2]) or '0') .. ARGV[2]
+local page = redis.call('HMGET', key, 'body', 'next_cursor')
+redis.call('HINCRBY', KEYS[1], page[1] and 'hits' or 'misses', 1)
+return {key, page[1], page[2]}
+"""
+
+get_recipe_script = ar.register_script(GET_RECIPE_SCRIPT)
+cache_recipe_script = ar.register_script(CACHE_RECIPE_SCRIPT)
+get_page_script = ar.register_script(GET_PAGE_SCRIPT)
+
+def _recipe_key(recipe_id: int) -> str:
+    return f"recipes:cache:recipe:{recipe_id}"
+
+def _recipe_version_key(recipe_id: int) -> str:
+    return f"recipes:cache:recipe:{recipe_id}:version"
+
+# Pages are keyed by the list generation, so one INCR invalidates every cached list and search page.
+# Key suffix after the generation.
+def _page_suffix(kind: str, params: dict) -> str:
+    fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f":{kind}:{fingerprint}"
+
+# Read-through helpers for a single recipe, cached as its serialized RecipeResponse JSON
+# and sent back without being parsed again.
+# Returns the recipe's cache version and the body or None. On a miss the body is stored with that version: it is
+# read before the row, so a body built from a row read before an invalidation is dropped instead of cached.
+async def get_cached_recipe(recipe_id: int) -> tuple[Optional[str], Optional[str]]:
+    try:
+        version, body = await get_recipe_script(keys=[STATS_KEY, _recipe_key(recipe_id), _recipe_version_key(recipe_id)])
+    except RedisError:
+        return None, None
+
+    return version, body
+
+async def cache_recipe(recipe_id: int, version: Optional[str], body: bytes):
+    if version is None:
+        return
+
+    try:
+        await cache_recipe_script(keys=[_recipe_key(recipe_id), _recipe_version_key(recipe_id)], args=[version, body, RECIPE_CACHE_TTL])
+    except RedisError:
+        pass
+
+# Read-through helpers for a page of recipes, a hash of the JSON body and the next cursor ("" on the last page).
+# Returns the page key and (body, next_cursor) or None. On a miss the page is stored under that key: the generation
+# is read once before the rows, so a page built from rows read before an invalidation never outlives it.
+async def get_cached_page(kind: str, params: dict) -> tuple[Optional[str], Optional[tuple[str, Optional[str]]]]:
+    try:
+        key, body, next_cursor = await get_page_script(keys=[STATS_KEY, GENERATION_KEY], args=[PAGE_KEY_PREFIX, _page_suffix(kind, params)])
+    except RedisError:
+        return None, None
+
+    return key, ((body, next_cursor or None) if body is not None else None)
+
+async def cache_page(key: Optional[str], body: bytes, next_cursor: Optional[str]):
+    if key is None:
+        return
+
+    try:
+        async with ar.pipeline() as pipe:
+            pipe.hset(key, mapping={"body": body, "next_cursor": next_cursor or ""})
+            pipe.expire(key, RECIPE_PAGE_CACHE_TTL)
+            await pipe.execute()
+    except RedisError:
+        pass
+
+# Called after a recipe is created, updated or deleted
+async def invalidate_recipe(recipe_id: int):
+    try:
+        async with ar.pipeline() as pipe:
+            pipe.delete(_recipe_key(recipe_id))
+            pipe.incr(_recipe_version_key(recipe_id))
+            pipe.expire(_recipe_version_key(recipe_id), RECIPE_VERSION_TTL)
+            pipe.incr(GENERATION_KEY)
+            await pipe.execute()
+    except RedisError:
+        pass
+
+# Called after recipes were added in bulk, only the list and search pages can be stale
+async def invalidate_pages():
+    try:
+        await ar.incr(GENERATION_KEY)
+    except RedisError:
+        pass
+
+async def get_cache_stats() -> dict:
+    try:
+        stats = await ar.hgetall(STATS_KEY)
+    except RedisError:
+        stats = {}
+
+    return {"hits": int(stats.get("hits", 0)), "misses": int(stats.get("misses", 0))}
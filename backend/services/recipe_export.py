@@ -0,0 +1,72 @@
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import Recipe, RecipeIngredient
+from services.recipe_serializer import RECIPE_COLUMNS, recipe_payload
+from typing import AsyncIterator
+import csv
+import io
+import json
+import orjson
+import os
+
+# Rows fetched per round trip from the server-side cursor (one row per ingredient)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CSV_COLUMNS = ["id", "recipe_name", "recipe_ingredients", "preperation_time", "dish_type", "calories", "image_url"]
+
+def _ndjson(payloads: list[dict]) -> bytes:
+    return b"".join(orjson.dumps(payload) + b"\n" for payload in payloads)
+
+# Ingredients are written as a JSON list in one column, so the file can be read back without ambiguity
+def _csv(payloads: list[dict]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for payload in payloads:
+        writer.writerow([
+            json.dumps(payload[column], ensure_ascii=False) if column == "recipe_ingredients" else payload[column]
+            for column in CSV_COLUMNS
+        ])
+    return buffer.getvalue().encode()
+
+def _csv_header() -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_COLUMNS)
+    return buffer.getvalue().encode()
+
+# Stream every recipe ordered by id. Recipes and their ingredients are read with one joined query through a
+# server-side cursor, consecutive rows of a recipe are grouped back together, and each fetched batch is sent
+# as soon as it is encoded, so memory use doesn't grow with the size of the table.
+# Runs in its own session, the response is still streaming after the request's session is closed.
+async def export_recipes(export_format: str) -> AsyncIterator[bytes]:
+    encode = _csv if export_format == "csv" else _ndjson
+    if export_format == "csv":
+        yield _csv_header()
+
+    query = (
+        select(*RECIPE_COLUMNS, RecipeIngredient.text.label("ingredient"))
+        .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+        .order_by(Recipe.id, RecipeIngredient.position)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query)
+        current, ingredients = None, []
+
+        async for rows in result.partitions():
+            completed = []
+            for row in rows:
+                if current is None or row.id != current.id:
+                    if current is not None:
+                        completed.append(recipe_payload(current, ingredients))
+                    current, ingredients = row, []
+
+                if row.ingredient is not None:
+                    ingredients.append(row.ingredient)
+
+            if completed:
+                yield encode(completed)
+
+        if current is not None:
+            yield encode([recipe_payload(current, ingredients)])
@@ -0,0 +1,220 @@
+from sqlalchemy import Table, Column, Integer, String, MetaData, select, update, delete, func, text, literal_column, bindparam
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from database import DATABASE_URL
+from services.ingredient_index import PREFIX_END
+from typing import Optional
+from collections import Counter
+import os
+import re
+
+# Full-text index over recipe names, dish types and ingredients.
+# SQLite keeps it in an FTS5 table ranked with bm25(), Postgres in a weighted tsvector table with a GIN index
+# ranked with ts_rank_cd(). Both tokenize the same way (lowercase words, no stemming, accents kept),
+# created by migration 0009 and updated by the recipe write endpoints.
+SEARCH_DIALECT = "postgresql" if DATABASE_URL.get_backend_name() == "postgresql" else "sqlite"
+
+# bm25 weight of each FTS5 column: a match in the name counts most, then the dish type, then an ingredient
+# (the Postgres document is weighted A, B and C the same way)
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+MAX_QUERY_TERMS = int(os.getenv("SEARCH_MAX_QUERY_TERMS", 8))
+# Vocabulary terms compared against a misspelled query term
+MAX_TYPO_CANDIDATES = int(os.getenv("SEARCH_MAX_TYPO_CANDIDATES", 5000))
+
+TERM_PATTERN = re.compile(r"[^\W_]+")
+
+metadata = MetaData()
+
+# Every indexed word with the number of recipes using it, used to correct misspelled query terms.
+# A term is removed when its last recipe is deleted or changed, so corrections always lead to results.
+search_terms = Table(
+    "recipe_search_terms", metadata,
+    Column("term", String, primary_key=True),
+    Column("recipe_count", Integer, nullable=False),
+)
+
+if SEARCH_DIALECT == "postgresql":
+    search_index = Table(
+        "recipe_search", metadata,
+        Column("recipe_id", Integer, primary_key=True),
+        Column("document", TSVECTOR, nullable=False),
+    )
+else:
+    search_index = Table("recipe_search", metadata, Column("rowid", Integer, primary_key=True))
+
+def terms_of(*texts: str) -> list[str]:
+    return TERM_PATTERN.findall(" ".join(texts).lower())
+
+# Parameters of one indexed recipe, executed with index_statement()
+def document(recipe_id: int, recipe_name: str, dish_type: str, ingredients: list[str]) -> dict:
+    return {"recipe_id": recipe_id, "recipe_name": recipe_name, "dish_type": dish_type, "ingredients": " ".join(ingredients)}
+
+def recipe_document(recipe) -> dict:
+    return document(recipe.id, recipe.recipe_name, recipe.dish_type, recipe.recipe_ingredients)
+
+def document_terms(values: dict) -> set[str]:
+    return set(terms_of(values["recipe_name"], values["dish_type"], values["ingredients"]))
+
+# Insert or replace the indexed text of recipes
+def index_statement(dialect: str = SEARCH_DIALECT):
+    if dialect == "postgresql":
+        return text(
+            "INSERT INTO recipe_search (recipe_id, document) VALUES (:recipe_id, "
+            "setweight(to_tsvector('simple', :recipe_name), 'A') || "
+            "setweight(to_tsvector('simple', :dish_type), 'B') || "
+            "setweight(to_tsvector('simple', :ingredients), 'C')) "
+            "ON CONFLICT (recipe_id) DO UPDATE SET document = excluded.document"
+        )
+
+    return text(
+        "INSERT OR REPLACE INTO recipe_search (rowid, recipe_name, dish_type, ingredients) "
+        "VALUES (:recipe_id, :recipe_name, :dish_type, :ingredients)"
+    )
+
+# Add recipe_count to the count of each term, creating the terms that are new
+def terms_statement(dialect: str = SEARCH_DIALECT):
+    insert = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(search_terms)
+    return insert.on_conflict_do_update(
+        index_elements=[search_terms.c.term],
+        set_={"recipe_count": search_terms.c.recipe_count + insert.excluded.recipe_count}
+    )
+
+# Rows for terms_statement(): the number of documents using each term
+def term_rows(documents: list[dict]) -> list[dict]:
+    counts = Counter()
+    for values in documents:
+        counts.update(document_terms(values))
+    return [{"term": term, "recipe_count": count} for term, count in sorted(counts.items())]
+
+# Apply per term changes of the recipe counts, dropping the terms no recipe uses anymore.
+# Terms are updated in sorted order so concurrent writers lock them in the same order.
+async def _count_terms(db: AsyncSession, added: set[str], removed: set[str]):
+    if added:
+        await db.execute(terms_statement(), [{"term": term, "recipe_count": 1} for term in sorted(added)])
+
+    if removed:
+        await db.execute(
+            update(search_terms).where(search_terms.c.term == bindparam("old_term")).values(recipe_count=search_terms.c.recipe_count - 1),
+            [{"old_term": term} for term in sorted(removed)]
+        )
+        await db.execute(delete(search_terms).where(search_terms.c.term.in_(removed), search_terms.c.recipe_count <= 0))
+
+# Add new recipes to the index, in the caller's transaction
+async def index_recipes(db: AsyncSession, documents: list[dict]):
+    if not documents:
+        return
+
+    await db.execute(index_statement(), documents)
+    await db.execute(terms_statement(), term_rows(documents))
+
+async def index_recipe(db: AsyncSession, values: dict):
+    await index_recipes(db, [values])
+
+# Replace the indexed text of a recipe, old and new are its document() before and after the change
+async def reindex_recipe(db: AsyncSession, old: dict, new: dict):
+    await db.execute(index_statement(), [new])
+
+    old_terms, new_terms = document_terms(old), document_terms(new)
+    await _count_terms(db, new_terms - old_terms, old_terms - new_terms)
+
+async def remove_recipe(db: AsyncSession, old: dict):
+    key = search_index.c.recipe_id if SEARCH_DIALECT == "postgresql" else search_index.c.rowid
+    await db.execute(delete(search_index).where(key == old["recipe_id"]))
+    await _count_terms(db, set(), document_terms(old))
+
+# Optimal string alignment distance (Levenshtein plus transpositions of adjacent letters),
+# giving up once it is certain to exceed limit
+def edit_distance(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    before, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+
+    return previous[-1]
+
+# Typos allowed in a query term of this length
+def max_typos(term: str) -> int:
+    return 0 if len(term) <= 3 else 1 if len(term) <= 6 else 2
+
+# Indexed words a misspelled term could be: starting with its first or second letter (which also covers swapped
+# first letters and an extra first letter) and about as long, the words used by most recipes first.
+# Both filters are cheap on the primary key and the order keeps the candidate set the same from one query to the next.
+async def _typo_candidates(db: AsyncSession, term: str, limit: int) -> dict[str, int]:
+    candidates = {}
+    for first in dict.fromkeys(term[:2]):
+        rows = await db.execute(
+            select(search_terms.c.term, search_terms.c.recipe_count)
+            .where(search_terms.c.term >= first, search_terms.c.term < first + PREFIX_END)
+            .where(func.length(search_terms.c.term).between(len(term) - limit, len(term) + limit))
+            .order_by(search_terms.c.recipe_count.desc(), search_terms.c.term)
+            .limit(MAX_TYPO_CANDIDATES)
+        )
+        candidates.update(rows.all())
+    return candidates
+
+# Closest candidate within limit typos, the more used word on a tie
+def _closest(term: str, candidates: dict[str, int], limit: int) -> str:
+    distance, _, closest = min(
+        ((edit_distance(term, candidate, limit), -count, candidate) for candidate, count in candidates.items()),
+        default=(limit + 1, 0, term)
+    )
+    return closest if distance <= limit else term
+
+# Replace query terms that are not the start of any indexed word by the closest indexed word.
+# The distances are computed in the thread pool, they are CPU bound.
+async def correct_terms(db: AsyncSession, terms: list[str]) -> list[str]:
+    misspelled = {}
+
+    for term in terms:
+        known = await db.scalar(
+            select(search_terms.c.term).where(search_terms.c.term >= term, search_terms.c.term < term + PREFIX_END).limit(1)
+        )
+        limit = max_typos(term)
+        if known is None and limit > 0:
+            misspelled[term] = (await _typo_candidates(db, term, limit), limit)
+
+    if not misspelled:
+        return terms
+
+    corrections = await run_in_threadpool(
+        lambda: {term: _closest(term, candidates, limit) for term, (candidates, limit) in misspelled.items()}
+    )
+    return [corrections.get(term, term) for term in terms]
+
+# Subquery of the recipes matching every term of a free-text query, as (id, score) with lower scores ranking first.
+# Each term matches words starting with it ("tom" finds "tomatoes"), misspelled terms are corrected first.
+# Returns None when the query has no words.
+async def text_matches(db: AsyncSession, query: str) -> Optional[object]:
+    terms = list(dict.fromkeys(terms_of(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+
+    terms = await correct_terms(db, terms)
+
+    if SEARCH_DIALECT == "postgresql":
+        tsquery = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        return (
+            select(search_index.c.recipe_id.label("id"), (-func.ts_rank_cd(search_index.c.document, tsquery)).label("score"))
+            .where(search_index.c.document.op("@@")(tsquery))
+            .subquery("text_matches")
+        )
+
+    fts = literal_column("recipe_search")
+    return (
+        select(search_index.c.rowid.label("id"), func.bm25(fts, *BM25_WEIGHTS).label("score"))
+        .where(fts.op("MATCH")(" ".join(f'"{term}"*' for term in terms)))
+        .subquery("text_matches")
+    )
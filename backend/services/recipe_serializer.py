@@ -0,0 +1,48 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Recipe, RecipeIngredient
+from services.image_service import variant_urls
+import orjson
+
+# Columns of a recipe response. Read endpoints select these as plain rows, building ORM objects
+# and validating them through RecipeResponse attribute by attribute costs more than the query itself.
+RECIPE_COLUMNS = (Recipe.id, Recipe.recipe_name, Recipe.preperation_time, Recipe.dish_type, Recipe.calories, Recipe.image_url)
+
+# Ingredient texts of several recipes in one query, in their original order
+async def ingredient_texts(db: AsyncSession, recipe_ids: list[int]) -> dict[int, list[str]]:
+
+    texts = {recipe_id: [] for recipe_id in recipe_ids}
+    if not recipe_ids:
+        return texts
+
+    rows = await db.execute(
+        select(RecipeIngredient.recipe_id, RecipeIngredient.text)
+        .where(RecipeIngredient.recipe_id.in_(recipe_ids))
+        .order_by(RecipeIngredient.recipe_id, RecipeIngredient.position)
+    )
+    for recipe_id, text in rows:
+        texts[recipe_id].append(text)
+
+    return texts
+
+# Same fields, in the same order, as schemas.RecipeResponse
+def recipe_payload(row, ingredients: list[str]) -> dict:
+    return {
+        "id": row.id,
+        "recipe_name": row.recipe_name,
+        "recipe_ingredients": ingredients,
+        "preperation_time": row.preperation_time,
+        "dish_type": row.dish_type,
+        "calories": row.calories,
+        "image_url": row.image_url,
+        "image_variants": variant_urls(row.image_url),
+    }
+
+# JSON body of a list of recipe rows (RECIPE_COLUMNS), ready to be sent and cached as is
+async def serialize_recipes(db: AsyncSession, rows) -> bytes:
+    texts = await ingredient_texts(db, [row.id for row in rows])
+    return orjson.dumps([recipe_payload(row, texts[row.id]) for row in rows])
+
+async def serialize_recipe(db: AsyncSession, row) -> bytes:
+    texts = await ingredient_texts(db, [row.id])
+    return orjson.dumps(recipe_payload(row, texts[row.id]))
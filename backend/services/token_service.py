@@ -0,0 +1,15 @@
+import hashlib
+import secrets
+
+# Opaque tokens handed out to clients (refresh, email verification, password reset).
+# Only the SHA-256 digest is stored, so a leaked database holds no usable tokens and
+# lookups are plain equality matches on an indexed column.
+# The tokens carry 256 bits of randomness, so an unsalted fast hash is sufficient here.
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Return a new token and the digest to store for it
+def generate_token() -> tuple[str, str]:
+    token = secrets.token_urlsafe(32)
+    return token, hash_token(token)
@@ -0,0 +1,117 @@
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import RefreshToken
+from redis_client import ar
+from services.token_service import generate_token, hash_token
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+REFRESH_TOKEN_SWEEP_INTERVAL_SECONDS = int(os.getenv("REFRESH_TOKEN_SWEEP_INTERVAL_SECONDS", 3600))
+
+# Refresh tokens kept in the refresh_tokens table, expired rows are removed by a background sweeper
+class SqlRefreshTokenStore:
+
+    async def issue(self, db: AsyncSession, user_id: int) -> str:
+        token, digest = generate_token()
+        db.add(RefreshToken(
+            user_id=user_id,
+            token=digest,
+            expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        ))
+        await db.commit()
+
+        return token
+
+    # Consume a valid token and issue its replacement in one transaction.
+    # The DELETE ... RETURNING claims the token, so a token can only ever be rotated once.
+    async def rotate(self, db: AsyncSession, token: str) -> Optional[tuple[int, str]]:
+        user_id = await db.scalar(
+            delete(RefreshToken)
+            .where(RefreshToken.token == hash_token(token), RefreshToken.expires_at > datetime.utcnow())
+            .returning(RefreshToken.user_id)
+        )
+
+        if user_id is None:
+            await db.rollback()
+            return None
+
+        return user_id, await self.issue(db, user_id)
+
+    async def revoke(self, db: AsyncSession, token: str):
+        await db.execute(delete(RefreshToken).where(RefreshToken.token == hash_token(token)))
+        await db.commit()
+
+    # Uses the expires_at index, runs periodically instead of on every refresh
+    async def sweep(self) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(RefreshToken).where(RefreshToken.expires_at < datetime.utcnow()))
+            await db.commit()
+
+        return result.rowcount
+
+# Refresh tokens kept in Redis with a native TTL, so nothing needs sweeping
+class RedisRefreshTokenStore:
+
+    # GET + DEL of the old token and SET of the new one, executed atomically
+    ROTATE_SCRIPT = """
+    local user_id = redis.call('GET', KEYS[1])
+    if not user_id then
+        return false
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('SET', KEYS[2], user_id, 'EX', ARGV[1])
+    return user_id
+    """
+
+    def __init__(self):
+        self.ttl = REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600
+        self.rotate_script = ar.register_script(self.ROTATE_SCRIPT)
+
+    # Keys hold the token digest, never the token itself
+    def _key(self, digest: str) -> str:
+        return f"refresh_token:{digest}"
+
+    async def issue(self, db: AsyncSession, user_id: int) -> str:
+        token, digest = generate_token()
+        await ar.set(self._key(digest), user_id, ex=self.ttl)
+
+        return token
+
+    async def rotate(self, db: AsyncSession, token: str) -> Optional[tuple[int, str]]:
+        new_token, new_digest = generate_token()
+        user_id = await self.rotate_script(keys=[self._key(hash_token(token)), self._key(new_digest)], args=[self.ttl])
+
+        if user_id is None:
+            return None
+
+        return int(user_id), new_token
+
+    async def revoke(self, db: AsyncSession, token: str):
+        await ar.delete(self._key(hash_token(token)))
+
+    async def sweep(self) -> int:
+        return 0
+
+refresh_token_store = RedisRefreshTokenStore() if os.getenv("REFRESH_TOKEN_STORE") == "redis" else SqlRefreshTokenStore()
+
+# Background loop started with the application
+async def run_refresh_token_sweeper():
+    if isinstance(refresh_token_store, RedisRefreshTokenStore):
+        return
+
+    while True:
+        try:
+            swept = await refresh_token_store.sweep()
+            if swept:
+                logger.info("Removed %d expired refresh tokens", swept)
+        except Exception:
+            logger.exception("Refresh token sweep failed")
+
+        await asyncio.sleep(REFRESH_TOKEN_SWEEP_INTERVAL_SECONDS)
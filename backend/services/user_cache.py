@@ -0,0 +1,128 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import RedisError
+from redis_client import ar
+from models import User, UserRole
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# In-process tier, invalidated through INVALIDATION_CHANNEL. The short TTL bounds how stale it gets while a worker
+# isn't subscribed (Redis down)
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 10))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+# Optional Redis tier shared by all workers, invalidated precisely
+USER_CACHE_REDIS = os.getenv("USER_CACHE_REDIS", "false").lower() == "true"
+USER_CACHE_REDIS_TTL = int(os.getenv("USER_CACHE_REDIS_TTL", 300))
+
+# Ids of invalidated users are published here, every worker drops them from its in-process tier
+INVALIDATION_CHANNEL = "users:principal:invalidate"
+POLL_SECONDS = 5
+
+# The fields of a user needed for authentication and authorization, without secrets or profile data
+@dataclass(frozen=True)
+class UserPrincipal:
+    id: int
+    username: str
+    email: str
+    role: UserRole
+    profile_image: Optional[str]
+    is_verified: bool
+
+PRINCIPAL_COLUMNS = (User.id, User.username, User.email, User.role, User.profile_image, User.is_verified)
+
+_local: OrderedDict[int, tuple[float, UserPrincipal]] = OrderedDict()
+
+def _redis_key(user_id: int) -> str:
+    return f"users:principal:{user_id}"
+
+def _remember(principal: UserPrincipal):
+    _local[principal.id] = (time.monotonic() + USER_CACHE_TTL, principal)
+    _local.move_to_end(principal.id)
+    if len(_local) > USER_CACHE_SIZE:
+        _local.popitem(last=False)
+
+async def _load_from_redis(user_id: int) -> Optional[UserPrincipal]:
+    try:
+        cached = await ar.get(_redis_key(user_id))
+    except RedisError:
+        return None
+
+    if cached is None:
+        return None
+
+    data = json.loads(cached)
+    return UserPrincipal(**{**data, "role": UserRole(data["role"])})
+
+async def _store_in_redis(principal: UserPrincipal):
+    try:
+        data = {**asdict(principal), "role": principal.role.value}
+        await ar.set(_redis_key(principal.id), json.dumps(data), ex=USER_CACHE_REDIS_TTL)
+    except RedisError:
+        pass
+
+# Principal of a user id, from the LRU, then Redis (if enabled), then one narrow database query
+async def get_user_principal(db: AsyncSession, user_id: int) -> Optional[UserPrincipal]:
+
+    entry = _local.get(user_id)
+    if entry and entry[0] > time.monotonic():
+        _local.move_to_end(user_id)
+        return entry[1]
+
+    principal = await _load_from_redis(user_id) if USER_CACHE_REDIS else None
+
+    if principal is None:
+        row = (await db.execute(select(*PRINCIPAL_COLUMNS).where(User.id == user_id))).first()
+        if row is None:
+            return None
+
+        principal = UserPrincipal(*row)
+        if USER_CACHE_REDIS:
+            await _store_in_redis(principal)
+
+    _remember(principal)
+    return principal
+
+# Call after any change to a user (verification, password, MFA or role): drops the Redis entry and, through
+# INVALIDATION_CHANNEL, the in-process entry of every worker
+async def invalidate_user(user_id: int):
+    _local.pop(user_id, None)
+
+    try:
+        async with ar.pipeline(transaction=False) as pipe:
+            pipe.delete(_redis_key(user_id))
+            pipe.publish(INVALIDATION_CHANNEL, user_id)
+            await pipe.execute()
+    except RedisError:
+        pass
+
+# Background loop started with the application, applies the invalidations published by every worker.
+# Messages sent while it isn't subscribed are lost, so the in-process tier is cleared on every (re)subscription.
+async def run_user_cache_listener():
+    while True:
+        try:
+            async with ar.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                _local.clear()
+
+                while True:
+                    # asyncio.wait_for() in the Redis client can swallow a cancellation (Python 3.11), the request still stands
+                    if asyncio.current_task().cancelling():
+                        raise asyncio.CancelledError()
+
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_SECONDS)
+                    if message is not None:
+                        _local.pop(int(message["data"]), None)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("User cache listener error")
+            await asyncio.sleep(POLL_SECONDS)
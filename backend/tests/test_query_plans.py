@@ -0,0 +1,137 @@
+# Query plans of the recipe list and search: a migrated database is seeded through the bulk import, then
+# EXPLAIN QUERY PLAN must show every page, cursor and count query reading the recipes it needs through an index.
+# The only full read of the recipes table allowed is the unfiltered list page, which walks the primary key in id
+# order and stops after one page.
+import asyncio
+import itertools
+import json
+import random
+
+import pytest
+from sqlalchemy import text, select, func, insert
+
+# Filter values of each search shape, combined in every possible way
+FILTERS = {
+    "recipe_ingredients": json.dumps(["tomato"]),
+    "preperation_time": 6,
+    "dish_type": "main",
+    "calories": 60,
+}
+FILTER_SHAPES = [names for size in range(1, len(FILTERS) + 1) for names in itertools.combinations(FILTERS, size)]
+
+TEXT_QUERY = "tomato"
+RECIPES = 5000
+PAGE = 11
+
+DISH_TYPES = ["Main course", "Starter", "Dessert", "Soup", "Salad", "Breakfast", "Snack", "Side dish"]
+INGREDIENTS = ["tomato", "onion", "garlic", "flour", "milk", "egg", "rice", "chicken", "basil", "lemon", "potato", "cheese"]
+
+def recipe_lines() -> list[bytes]:
+    rng = random.Random(0)
+    return [
+        json.dumps({
+            "recipe_name": f"Recipe {number}", "recipe_ingredients": rng.sample(INGREDIENTS, 4),
+            "preperation_time": rng.randint(5, 180), "dish_type": rng.choice(DISH_TYPES), "calories": rng.randint(50, 1500),
+        }).encode()
+        for number in range(RECIPES)
+    ]
+
+async def seed_and_match():
+    from database import AsyncSessionLocal, async_engine
+    from models import User, UserRole
+    from services.bulk_import import BulkImport
+    from services.recipe_search import text_matches
+
+    async def lines():
+        for line in recipe_lines():
+            yield line
+
+    async with AsyncSessionLocal() as db:
+        owner_id = (await db.execute(
+            insert(User).values(username="owner", email="owner@example.com", password_hash="-", role=UserRole.USER).returning(User.id)
+        )).scalar_one()
+        await db.commit()
+
+        report = await BulkImport(db, owner_id).run(lines())
+        assert report["created"] == RECIPES
+
+        matches = await text_matches(db, TEXT_QUERY)
+
+    await async_engine.dispose()
+    return matches
+
+# Migrated and seeded database, with the full-text match subquery of TEXT_QUERY
+@pytest.fixture(scope="module")
+def database():
+    from database import engine
+    from migrations import upgrade
+
+    upgrade(engine)
+    matches = asyncio.run(seed_and_match())
+
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        yield conn, matches
+
+def explain(conn, query) -> list[str]:
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+# Plan steps reading a whole table. A MATCH on the full-text table is shown as a scan of the virtual table
+# (index string "M..."), it is an index lookup.
+def full_scans(plan: list[str]) -> list[str]:
+    return [
+        step for step in plan
+        if step.startswith("SCAN") and "COVERING INDEX" not in step
+        and not ("VIRTUAL TABLE INDEX" in step and ":M" in step)
+    ]
+
+def search(names) -> dict:
+    return {name: FILTERS[name] if name in names else None for name in FILTERS}
+
+def test_list_page_walks_the_primary_key(database):
+    from routers.recipes import page_query
+    from services.pagination import encode_cursor
+    from services.recipe_serializer import RECIPE_COLUMNS
+
+    conn, _ = database
+    query = select(*RECIPE_COLUMNS)
+
+    # Stops after one page, as long as the rows come out in id order without a sort
+    plan = explain(conn, page_query(query, None).limit(PAGE))
+    assert plan == ["SCAN recipes"]
+
+    plan = explain(conn, page_query(query, encode_cursor(100)).limit(PAGE))
+    assert full_scans(plan) == [], plan
+
+@pytest.mark.parametrize("names", FILTER_SHAPES, ids=" + ".join)
+def test_search_uses_indexes(database, names):
+    from routers.recipes import search_query, page_query
+    from services.pagination import encode_cursor
+
+    conn, _ = database
+    query = search_query(**search(names))
+
+    for plan in (
+        explain(conn, page_query(query, None).limit(PAGE)),
+        explain(conn, page_query(query, encode_cursor(100)).limit(PAGE)),
+        explain(conn, select(func.count()).select_from(query.subquery())),
+    ):
+        assert full_scans(plan) == [], plan
+
+@pytest.mark.parametrize("names", [()] + FILTER_SHAPES, ids=lambda names: " + ".join(("q",) + names))
+def test_text_search_uses_indexes(database, names):
+    from models import Recipe
+    from routers.recipes import search_query, page_query
+    from services.pagination import encode_cursor
+
+    conn, matches = database
+    query = search_query(**search(names)).join(matches, matches.c.id == Recipe.id)
+    score = matches.c.score
+
+    for plan in (
+        explain(conn, page_query(query, None, score).limit(PAGE)),
+        explain(conn, page_query(query, encode_cursor(100, -1.0), score).limit(PAGE)),
+        explain(conn, select(func.count()).select_from(query.subquery())),
+    ):
+        assert full_scans(plan) == [], plan